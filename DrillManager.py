@@ -11,22 +11,32 @@
 """
 from PyQt5.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, QVariant
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QAction, QDialog, QProgressBar, QProgressDialog, qApp
+from PyQt5.QtWidgets import QAction, QDialog, QProgressBar
 
 from qgis.core import *
 from qgis.utils import *
 from qgis.gui import *
 import numpy as np
 
-from .quaternion import Quaternion
+from .composite import fixedLengthIntervals, compositeIntervals
+from .intervalqa import checkIntervals, qaIssues
+from .desurvey import desurveyHoleChunks, desurveyMethods, SurveyIndex, holeFingerprint, traceMeasures, intervalTraces, pointTraces, alphaBetaToDipDirection
+from .spatialindex import SegmentIndexWriter, segmentIndexFilename
 
 # Initialize Qt resources from file resources.py
 from .resources import *
 from .drillsetup_dialog import DrillSetupDialog
-from .drilltrace_dialog import DrillTraceDialog
+from .drilltrace_dialog import DrillTraceDialog, DownholeTable
+from .drillpoint_dialog import DrillPointDialog
 
 import os.path
 import math
+import json
+import heapq
+import pickle
+import tempfile
+import traceback
+import copy
 import platform
 
 class Collar:
@@ -38,12 +48,6 @@ class Collar:
     az = 0.0
     dip = 0.0
 
-class Survey:
-    id = ''
-    depth = 0.0
-    az = 0.0
-    dip = 0.0
-    
 class Surveys:
     depth = 0.0
     az = 0.0
@@ -105,6 +109,14 @@ def readProjectNum(entry, default):
     else:
         return default
     
+# Retrieve a floating point number from the QGIS project file with the supplied entry label
+def readProjectDouble(entry, default):
+    val, ok = QgsProject.instance().readDoubleEntry ("Geoscience", entry)
+    if ok:
+        return val
+    else:
+        return default
+    
 # Retrieve a bool from the QGIS project file with the supplied entry label
 def readProjectBool(entry, default):
     val, ok = QgsProject.instance().readBoolEntry ("Geoscience", entry)
@@ -117,22 +129,35 @@ def readProjectBool(entry, default):
 def writeProjectData(entry, val):
     QgsProject.instance().writeEntry("Geoscience", entry, val)
 
-# Calculate an interpolated 3D point at given depth from the supplied polyline.
-# The polyline must have constant segment lengths given by segLength
-def interpPolyline(depth, segLength, polyline):
-    p = QgsPoint()
-    i = depth / segLength
-    i0 = int(i)
-    ratio = i - i0
-
-    p0 = polyline[i0]
-    if ratio > 0.0:
-        p1 = polyline[i0 + 1]
-        dp = (p1 - p0) * ratio
-        p = p0 + dp
-    else:
-        p = p0
-    return p, i
+# Retrieve the list of downhole tables from the QGIS project file with the supplied entry label
+# Each table is stored as its layer name, field mapping, suffix and attribute field names.
+# Tables whose layer is no longer in the project are dropped.
+def readProjectTables(entry):
+    tables = []
+    text, ok = QgsProject.instance().readEntry("Geoscience", entry)
+    if not ok or not text:
+        return tables
+    try:
+        for t in json.loads(text):
+            layer = getLayerByName(t["layer"])
+            if layer is not None:
+                tables.append(DownholeTable(layer, t["id"], t["from"], t["to"], t["suffix"], t["fields"],
+                                            t.get("compositeMethod", "None"), t.get("compositeLength", 2.0),
+                                            getLayerByName(t.get("compositeLayer", "")), t.get("compositeId", ""),
+                                            t.get("compositeFrom", ""), t.get("compositeTo", "")))
+    except (ValueError, KeyError, TypeError):
+        pass
+    return tables
+
+# Write the supplied list of downhole tables into the QGIS project file next to the supplied entry label
+def writeProjectTables(entry, tables):
+    text = json.dumps([{"layer": t.layer.name(), "id": t.dataId, "from": t.dataFrom, "to": t.dataTo,
+                        "suffix": t.suffix, "fields": t.fields,
+                        "compositeMethod": t.compositeMethod, "compositeLength": t.compositeLength,
+                        "compositeLayer": t.compositeLayer.name() if t.compositeLayer is not None else "",
+                        "compositeId": t.compositeId, "compositeFrom": t.compositeFrom, "compositeTo": t.compositeTo}
+                       for t in tables if t.layer is not None])
+    QgsProject.instance().writeEntry("Geoscience", entry, text)
 
 # Process the url to provide a valid filename
 def uriToFile(url):
@@ -146,6 +171,444 @@ def uriToFile(url):
     fileName = os.path.normpath(fileName)
     return fileName
     
+# Remove the layer loaded from a GeoPackage file name (without extension) from the project, so the file can be overwritten.
+# This has to be done on the main thread, before a task writes the file.
+# Returns the ID of the layer that was removed, or None.
+def removeLayerFile(fileName):
+    label = os.path.splitext(os.path.basename(fileName))[0]
+    oldLayer = getLayerByName(label)
+    if oldLayer is None:
+        return None
+    layerId = oldLayer.id()
+    QgsProject.instance().removeMapLayer(oldLayer)
+    return layerId
+
+# Add the GeoPackage written by a task to the project on the main thread. If the file is already loaded
+# (eg a trace layer updated in place) that layer is reloaded instead, keeping its style.
+def addLayerFile(fileName):
+    path = "%s.gpkg" % (fileName)
+    label = os.path.splitext(os.path.basename(fileName))[0]
+    layer = getLayerByName(label)
+    if layer is not None and layerFilename(layer) == os.path.normpath(fileName):
+        layer.dataProvider().reloadData()
+        layer.updateExtents()
+        layer.triggerRepaint()
+        return layer
+    layer = QgsVectorLayer(path, label)
+    QgsProject.instance().addMapLayer(layer)
+    return layer
+
+# Create an empty line GeoPackage of the given geometry type with the supplied fields, overwriting any existing file,
+# and open it so features can be streamed straight into it.
+# Any layer already loaded from the file must have been removed from the project first with removeLayerFile.
+def createGeoPackageLayer(fileName, fields, wkbType, crs):
+    # Calculate the filename for the on disk file
+    path = "%s.gpkg" % (fileName)
+
+    # work out a label for the layer from the file name
+    label = os.path.splitext(os.path.basename(fileName))[0]
+
+    # Create the empty file. The writer must be deleted to close the file before we open it again.
+    writer = QgsVectorFileWriter(path, "CP1250", fields, wkbType, crs, "GPKG", layerOptions=['OVERWRITE=YES'])
+    del writer
+
+    return QgsVectorLayer(path, label)
+
+# File name of the data source of a layer, without the extension
+def layerFilename(layer):
+    return os.path.splitext(uriToFile(layer.dataProvider().dataSourceUri().split("|")[0]))[0]
+
+# File name (without extension) of a layer built from the trace layer of a task, with the supplied suffix
+def downholeFilename(traceLayer, suffix):
+    return "%s_%s" % (traceLayer.fileName, suffix)
+
+# Build a feature request that only fetches the supplied attribute indices and no geometry.
+# Indices of fields that don't exist (-1) are ignored.
+def attributeRequest(indices):
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes([idx for idx in indices if idx > -1])
+    return request
+
+# Read the traces of a desurveyed trace layer one at a time. Yields the hole ID and trace of each feature,
+# the trace being an (N,4) array of x, y, z and measured depth.
+# If supplied, progress is called with the index of each feature as it is read.
+def readTraces(traceLayer, progress=None):
+    idxId = traceLayer.fields().indexFromName("CollarID")
+    idxSegLength = traceLayer.fields().indexFromName("SegLength")
+    hasM = QgsWkbTypes.hasM(traceLayer.wkbType())
+
+    # Read every trace once, fetching only the attributes we need along with the geometry
+    request = QgsFeatureRequest().setSubsetOfAttributes([idx for idx in [idxId, idxSegLength] if idx > -1])
+    for index, feature in enumerate(traceLayer.getFeatures(request)):
+        if progress is not None:
+            progress(index)
+        holeId = feature[idxId]
+        if holeId == NULL or not feature.hasGeometry():
+            continue
+        # The normal asPolyline() function only returns QgsPointXY, yet we need the Z coordinate as well
+        # We therefore get a vertex iterator for the abstractGeometry and build our own array
+        points = []
+        vi = feature.geometry().vertices()
+        while vi.hasNext():
+            p = vi.next()
+            points.append((p.x(), p.y(), p.z(), p.m()))
+        trace = np.array(points, dtype=float).reshape(-1, 4)
+        # Traces without M values get their measured depths from the segment length or the length along the trace
+        if not hasM:
+            segLength = feature[idxSegLength] if idxSegLength > -1 else None
+            trace[:, 3] = traceMeasures(trace[:, :3], None if segLength == NULL else segLength)
+        yield holeId.strip(), trace
+
+# Holds every trace of a desurveyed trace layer in memory, so downhole intervals can be positioned without
+# querying the layer for each hole. Each trace is an (N,4) array of x, y, z and measured depth.
+# If supplied, progress is called with the index of each feature as it is read.
+class TraceCache:
+    def __init__(self, traceLayer, progress=None):
+        self.traces = dict(readTraces(traceLayer, progress))
+
+    def __contains__(self, holeId):
+        return holeId in self.traces
+
+    def __len__(self):
+        return len(self.traces)
+
+    # Return the (N,4) trace array for the supplied hole
+    def trace(self, holeId):
+        return self.traces[holeId]
+
+# Providers that sort features in the data source itself when a request has an order by clause.
+# For any other provider QGIS would read the whole layer into memory to sort it.
+def providerCanOrder(layer):
+    dp = layer.dataProvider()
+    if dp.name() in ("postgres", "spatialite", "mssql", "oracle"):
+        return True
+    return dp.name() == "ogr" and dp.storageType() in ("GPKG", "SQLite")
+
+# Open the trace layer GeoPackage fileName (without extension) if it can be updated in place, ie it has measured
+# depths in M and a fingerprint for each trace. Returns None otherwise. The layer is opened separately from any
+# copy loaded in the project, so it can be used by the thread that opens it.
+def openTraceLayer(fileName):
+    path = "%s.gpkg" % (fileName)
+    if not os.path.exists(path):
+        return None
+    layer = QgsVectorLayer(path, os.path.splitext(os.path.basename(fileName))[0])
+    if not layer.isValid() or not QgsWkbTypes.hasM(layer.wkbType()):
+        return None
+    if layer.fields().indexFromName("CollarID") < 0 or layer.fields().indexFromName("Fingerprint") < 0:
+        return None
+    return layer
+
+# Whether the trace layer GeoPackage fileName (without extension) can be updated in place
+def traceLayerUpdatable(fileName):
+    return openTraceLayer(fileName) is not None
+
+# Open the existing trace layer fileName (without extension) and read the fingerprint of each trace.
+# Returns the open layer and a dictionary of CollarID -> (feature id, fingerprint),
+# or None and None if there is no trace layer that can be updated in place.
+def readTraceFingerprints(fileName):
+    layer = openTraceLayer(fileName)
+    if layer is None:
+        return None, None
+
+    idxId = layer.fields().indexFromName("CollarID")
+    idxFingerprint = layer.fields().indexFromName("Fingerprint")
+    traces = {}
+    for feature in layer.getFeatures(attributeRequest([idxId, idxFingerprint])):
+        traces[feature[idxId]] = (feature.id(), feature[idxFingerprint])
+    return layer, traces
+
+# A read only view of a vector layer for use in a background task. Features are read through a thread safe
+# feature source, while the fields and other details of the layer are copied on the main thread.
+class TaskLayer:
+    def __init__(self, layer):
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.layerFields = layer.fields()
+        self.layerName = layer.name()
+        self.count = layer.featureCount()
+        self.type = layer.wkbType()
+        self.crs = layer.sourceCrs()
+        self.fileName = layerFilename(layer)
+        self.canOrder = providerCanOrder(layer)
+
+    def getFeatures(self, request=None):
+        return self.source.getFeatures(QgsFeatureRequest() if request is None else request)
+
+    def fields(self):
+        return self.layerFields
+
+    def name(self):
+        return self.layerName
+
+    def featureCount(self):
+        return self.count
+
+    def wkbType(self):
+        return self.type
+
+    def sourceCrs(self):
+        return self.crs
+
+    # A TaskLayer is only made from a valid layer, and keeps its source open for the life of the task
+    def isValid(self):
+        return True
+
+# Dictionary encoding of repeated values. Each distinct value gets a small integer code and is stored once,
+# so a column that repeats a few hundred values millions of times (eg lithology codes) holds one instance of each.
+class ValueDictionary:
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    # Return the code of a value, adding it if it hasn't been seen before
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+    # Return the stored instance of a value, so equal values share one object
+    def share(self, value):
+        return self.values[self.encode(value)]
+
+# Dictionary encodes the text attributes of a layer's rows, for the supplied attribute indices.
+# Encoded rows hold integer codes in place of the text, and NULLs as None, so they can be pickled.
+class AttributeEncoder:
+    def __init__(self, fields, indices):
+        self.columns = [(idx, ValueDictionary()) for idx in sorted(set(indices))
+                        if 0 <= idx < fields.count() and fields.at(idx).type() == QVariant.String]
+
+    def encode(self, attrs):
+        row = [None if v == NULL else v for v in attrs]
+        for idx, values in self.columns:
+            if row[idx] is not None:
+                row[idx] = values.encode(row[idx])
+        return row
+
+    def decode(self, row):
+        attrs = [NULL if v is None else v for v in row]
+        for idx, values in self.columns:
+            if row[idx] is not None:
+                attrs[idx] = values.decode(row[idx])
+        return attrs
+
+# Stream (feature id, attributes) of a downhole layer ordered by hole ID and then depth, so that every hole's
+# records arrive together and in order. The sort is pushed down to the provider when it can do it.
+# Otherwise runs of sortRows records are sorted in memory and written to temporary files, which are then
+# merged, so memory use is bounded whatever the size of the layer. Records with no hole ID or depth are dropped
+# in that case, as they can't be sorted. The text attributes are dictionary encoded while they are sorted, so each
+# distinct value is held once. progress is called with the number of records read while sorting.
+def orderedFeatures(layer, request, idxId, idxDepth, sortRows, progress=None):
+    if layer.canOrder:
+        names = [QgsExpression.quotedColumnRef(layer.fields().at(idx).name()) for idx in (idxId, idxDepth)]
+        request.setOrderBy(QgsFeatureRequest.OrderBy([QgsFeatureRequest.OrderByClause(name, True) for name in names]))
+        for feature in layer.getFeatures(request):
+            yield feature.id(), feature.attributes()
+        return
+
+    encoder = AttributeEncoder(layer.fields(), request.subsetOfAttributes())
+    holeIds = ValueDictionary()
+    runs = []
+    try:
+        run = []
+        for count, feature in enumerate(layer.getFeatures(request)):
+            if progress is not None:
+                progress(count)
+            attrs = feature.attributes()
+            holeId = attrs[idxId]
+            depth = attrs[idxDepth]
+            if (holeId==NULL) or (depth==NULL):
+                continue
+            run.append((holeIds.share(holeId.strip()), float(depth), feature.id(), encoder.encode(attrs)))
+            if len(run) >= sortRows:
+                runs.append(writeSortedRun(run))
+                run = []
+        run.sort(key=lambda row: row[:3])
+
+        # Everything fitted in memory, so there's nothing to merge
+        if len(runs) == 0:
+            rows = run
+        else:
+            runs.append(writeSortedRun(run))
+            rows = heapq.merge(*[readSortedRun(f) for f in runs], key=lambda row: row[:3])
+        for holeId, depth, fid, row in rows:
+            yield fid, encoder.decode(row)
+    finally:
+        for f in runs:
+            f.close()
+
+# Sort a run of (hole ID, depth, feature id, attributes) records and write it to a temporary file, one record at a time
+def writeSortedRun(run):
+    run.sort(key=lambda row: row[:3])
+    f = tempfile.TemporaryFile()
+    for row in run:
+        pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+# Read back the records of a sorted run one at a time
+def readSortedRun(f):
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+# Convert an attribute value to a float, with NULL or non numeric values as NaN
+def attributeFloat(value):
+    try:
+        return np.nan if value == NULL else float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# Read the end of hole depth of every collar into a dictionary of CollarID -> depth.
+# Returns None if there is no collar layer, or its ID and depth fields aren't mapped.
+def readCollarDepths(collarLayer, idField, depthField):
+    depths = {}
+    if collarLayer is None:
+        return None
+    idxCollarId = collarLayer.fields().lookupField(idField)
+    idxCollarDepth = collarLayer.fields().lookupField(depthField)
+    if idxCollarId < 0 or idxCollarDepth < 0:
+        return None
+    for feature in collarLayer.getFeatures(attributeRequest([idxCollarId, idxCollarDepth])):
+        attrs = feature.attributes()
+        if (attrs[idxCollarId]==NULL) or (attrs[idxCollarDepth]==NULL):
+            continue
+        depths[attrs[idxCollarId].strip()] = float(attrs[idxCollarDepth])
+    return depths
+
+# Read the intervals of a downhole layer (eg lithology) into a dictionary of HoleID -> (from, to) arrays sorted by depth
+def readIntervalLayer(layer, idField, fromField, toField):
+    idxId = layer.fields().lookupField(idField)
+    idxFrom = layer.fields().lookupField(fromField)
+    idxTo = layer.fields().lookupField(toField)
+    holes = {}
+    if idxId < 0 or idxFrom < 0 or idxTo < 0:
+        return holes
+    for feature in layer.getFeatures(attributeRequest([idxId, idxFrom, idxTo])):
+        attrs = feature.attributes()
+        if (attrs[idxId]==NULL) or (attrs[idxFrom]==NULL) or (attrs[idxTo]==NULL):
+            continue
+        holes.setdefault(attrs[idxId].strip(), []).append((float(attrs[idxFrom]), float(attrs[idxTo])))
+    for holeId, intervals in holes.items():
+        intervals = np.array(sorted(intervals), dtype=float)
+        holes[holeId] = (intervals[:, 0], intervals[:, 1])
+    return holes
+
+# Composite the (row, attributes, from, to) intervals of one hole to fixed lengths or to the hole's intervals in
+# boundaries. Numeric attributes are length weighted averages, other attributes are left empty.
+# Returns the composites as intervals in the same form, with the sampled length at attribute index numFields.
+# Composites that weren't sampled at all are dropped.
+def compositeHole(table, holeId, rows, idxAttList, numeric, numFields, boundaries):
+    depthFrom = np.array([row[2] for row in rows], dtype=float)
+    depthTo = np.array([row[3] for row in rows], dtype=float)
+    numericIdx = [idx for idx, isNumeric in zip(idxAttList, numeric) if isNumeric]
+    # The extra column of ones gives the length sampled by any interval
+    values = np.array([[attributeFloat(row[1][idx]) for idx in numericIdx] + [1.0] for row in rows], dtype=float)
+
+    if boundaries is None:
+        compFrom, compTo = fixedLengthIntervals(depthFrom, depthTo, table.compositeLength)
+    else:
+        compFrom, compTo = boundaries.get(holeId, (np.zeros(0), np.zeros(0)))
+    compValue, compLength = compositeIntervals(depthFrom, depthTo, values, compFrom, compTo)
+
+    composites = []
+    compValue = compValue.tolist()
+    for k in np.flatnonzero(compLength[:, -1] > 0.0).tolist():
+        attrs = [None] * (numFields + 1)
+        for c, idx in enumerate(numericIdx):
+            v = compValue[k][c]
+            attrs[idx] = None if math.isnan(v) else v
+        attrs[numFields] = float(compLength[k, -1])
+        composites.append((k, attrs, float(compFrom[k]), float(compTo[k])))
+    return composites
+
+# Collects features and adds them to a feature sink (eg a layer's data provider) in batches.
+# This avoids opening an edit session, recording undo state and committing for every feature.
+class FeatureBatchWriter:
+    def __init__(self, sink, batchSize):
+        self.sink = sink
+        self.batchSize = max(1, int(batchSize))
+        self.features = []
+
+    # Queue a feature, sending the batch to the sink once it is full
+    def addFeature(self, feature):
+        self.features.append(feature)
+        if len(self.features) >= self.batchSize:
+            self.flush()
+
+    # Send any queued features to the sink
+    def flush(self):
+        if len(self.features) > 0:
+            self.sink.addFeatures(self.features)
+            self.features = []
+
+# Raised inside a task when the user cancels it, to unwind out of the work
+class TaskCanceled(Exception):
+    pass
+
+# A copy of the named DrillManager settings, taken on the main thread as a task starts.
+# Drill Setup can be changed while the task runs, so the task reads its settings from here instead.
+class TaskSettings:
+    def __init__(self, manager, names):
+        for name in names:
+            setattr(self, name, copy.copy(getattr(manager, name)))
+
+# Runs work(task) as a background task, so the map can still be used while it runs. The work reports its
+# progress in phases, each getting an equal share of the task's progress, and stops at its next progress
+# update once the task is canceled. done(result) is called on the main thread with what work returned,
+# or None if it was canceled or failed. The work must only read layers through TaskLayer and leave adding
+# layers to the project to done.
+class DrillTask(QgsTask):
+    def __init__(self, description, phases, work, done):
+        QgsTask.__init__(self, description, QgsTask.CanCancel)
+        self.phases = max(1, phases)
+        self.work = work
+        self.done = done
+        self.phase = -1
+        self.maximum = 1
+        self.result = None
+        self.error = None
+
+    # Start the next phase of the work, which has maximum steps
+    def setPhase(self, name, maximum=0):
+        self.phase = min(self.phase + 1, self.phases - 1)
+        self.maximum = max(1, maximum)
+        QgsMessageLog.logMessage("%s: %s" % (self.description(), name), "Geoscience", Qgis.Info)
+        self.setValue(0)
+
+    # Set the number of steps done in the current phase, stopping the work if the task has been canceled
+    def setValue(self, value):
+        if self.isCanceled():
+            raise TaskCanceled()
+        self.setProgress(100.0 * (self.phase + min(value, self.maximum) / self.maximum) / self.phases)
+
+    def run(self):
+        try:
+            self.result = self.work(self)
+        except TaskCanceled:
+            return False
+        except Exception:
+            self.error = traceback.format_exc()
+            return False
+        return True
+
+    def finished(self, result):
+        if self.error is not None:
+            QgsMessageLog.logMessage(self.error, "Geoscience", Qgis.Critical)
+            iface.messageBar().pushMessage("Geoscience", "%s failed. See the message log for details." % (self.description()), level=Qgis.Critical)
+        elif not result:
+            iface.messageBar().pushMessage("Geoscience", "%s was canceled." % (self.description()), level=Qgis.Warning)
+        self.done(self.result if result else None)
+
 # The DrillManager class controls all drill related data and methods 
 class DrillManager:
     def __init__(self):
@@ -153,9 +616,42 @@ class DrillManager:
         # We also do it here for when the plugin is loaded other than at startup
         self.readProjectData()
 
+        # The background task that is running, if any
+        self.task = None
+
         # Create a log file        
         self.openLogFile()
 
+    # The settings read by each background task
+    desurveySettings = ("collarId", "collarEast", "collarNorth", "collarElev", "collarDepth", "collarAz", "collarDip",
+                        "surveyId", "surveyDepth", "surveyAz", "surveyDip", "desurveyLength", "downDipNegative",
+                        "vertexTolerance", "desurveyMethod", "desurveyWorkers", "featureBatchSize")
+    traceSettings = ("collarId", "collarDepth", "featureBatchSize", "sortBufferRows")
+    pointSettings = ("pointId", "pointDepth", "pointAlpha", "pointBeta", "pointFields", "featureBatchSize", "sortBufferRows")
+
+    # The downhole tables whose layers are still in the project. Tables whose layer has been removed
+    # (and so deleted by QGIS) are dropped.
+    def liveDataTables(self):
+        self.dataTables = [table for table in self.dataTables if table.resolveLayers()]
+        return self.dataTables
+
+    # Run work(task) as a background DrillTask with the given number of progress phases, then call done(result)
+    # on the main thread. Only one task runs at a time, as they share the log file and output layers.
+    def runTask(self, description, phases, work, done):
+        def finished(result):
+            self.task = None
+            self.logFile.flush()
+            done(result)
+        self.task = DrillTask(description, phases, work, finished)
+        QgsApplication.taskManager().addTask(self.task)
+
+    # Check whether a task is already running, telling the user if it is
+    def taskRunning(self):
+        if self.task is None:
+            return False
+        iface.messageBar().pushMessage("Geoscience", "Please wait for %s to finish." % (self.task.description()), level=Qgis.Warning)
+        return True
+
     # Open a log file in the Collar Layer's directory
     def openLogFile(self):
         # Maintain a log file in case of data errors
@@ -180,6 +676,9 @@ class DrillManager:
         if result:
             self.downDipNegative = dlg.checkDownDipNegative.isChecked()
             self.desurveyLength = dlg.sbDesurveyLength.value()
+            self.desurveyWorkers = dlg.sbDesurveyWorkers.value()
+            self.desurveyMethod = dlg.cbDesurveyMethod.currentText()
+            self.vertexTolerance = dlg.sbVertexTolerance.value()
             self.defaultSectionWidth = dlg.teDefaultSectionWidth.text()
             self.defaultSectionStep = dlg.teDefaultSectionStep.text()
             self.collarLayer = dlg.lbCollarLayer.currentLayer()
@@ -220,6 +719,8 @@ class DrillManager:
             for index in range(dlg.listFields.count()):
                 if dlg.listFields.item(index).checkState():
                     self.dataFields.append(dlg.listFields.item(index).text())
+            # The tables to build traces for: those added to the list, or just the one set up above
+            self.dataTables = dlg.dataTables()
                     
             self.writeProjectData()
 
@@ -229,6 +730,32 @@ class DrillManager:
             # Create the down hole traces        
             self.createDownholeTrace()
 
+    # Setup and run the Drill Point dialog
+    def onDrillDisplayPoints(self):
+        dlg = DrillPointDialog(self)
+        dlg.show()
+        result = dlg.exec_()
+        if result:
+            self.pointLayer = dlg.lbDataLayer.currentLayer()
+            self.pointId = dlg.fbDataId.currentField()
+            self.pointDepth = dlg.fbDataDepth.currentField()
+            self.pointAlpha = dlg.fbDataAlpha.currentField()
+            self.pointBeta = dlg.fbDataBeta.currentField()
+            self.pointSuffix = dlg.teSuffix.text()
+            # Save the name of each checked attribute field in a list
+            self.pointFields = []
+            for index in range(dlg.listFields.count()):
+                if dlg.listFields.item(index).checkState():
+                    self.pointFields.append(dlg.listFields.item(index).text())
+                    
+            self.writeProjectData()
+
+        dlg.close()
+
+        if result:
+            # Create the down hole points
+            self.createDownholePoints()
+
     # Desurvey the data        
     def onDesurveyData(self):
         self.desurveyData()
@@ -237,64 +764,117 @@ class DrillManager:
     def onDrillCreateSection(self):
         pass
 
-    # Create the down hole traces    
+    # Create the down hole traces for every downhole table in a single background task
     def createDownholeTrace(self):
+        if self.taskRunning():
+            return
         self.logFile.write("\nCreating Trace Layer.\n")
         self.logFile.flush()
         
         # Check that desurvey layer is available
-        if not self.traceLayer.isValid() or not self.dataLayer.isValid():
+        if self.traceLayer is None or not self.traceLayer.isValid():
+            return
+        tables = [table for table in self.liveDataTables() if table.layer.isValid()]
+        if len(tables) == 0:
             return
-        
-        # Set up a progress display
-        pd = QProgressDialog()
-        pd.setAutoReset(False)
-        pd.setWindowTitle("Build Trace Layer")
-        pd.setMinimumWidth(500)
-        pd.setMinimum(0)
-        pd.setMaximum(self.dataLayer.featureCount())
-        pd.setValue(0)
-
-        # Create memory layer
-        layer = self.createDownholeLayer()
 
+        # Give the task its own copy of each table, reading the layers through thread safe sources
+        traceLayer = TaskLayer(self.traceLayer)
+        collarLayer = TaskLayer(self.collarLayer) if self.collarLayer is not None and self.collarLayer.isValid() else None
+        taskTables = []
+        for table in tables:
+            taskTable = copy.copy(table)
+            taskTable.layer = TaskLayer(table.layer)
+            # The task never touches the project layers themselves, so an unusable composite layer is dropped here
+            if table.compositeLayer is not None and table.compositeLayer.isValid():
+                taskTable.compositeLayer = TaskLayer(table.compositeLayer)
+            else:
+                taskTable.compositeLayer = None
+            taskTables.append(taskTable)
+            # The layers that will be overwritten are removed from the project before the task starts
+            removeLayerFile(downholeFilename(traceLayer, table.suffix))
+            removeLayerFile(downholeFilename(traceLayer, table.suffix + "_QA"))
+
+        settings = TaskSettings(self, self.traceSettings)
+        self.runTask("Build Trace Layer", 1 + 2 * len(taskTables),
+                     lambda task: self.buildDownholeTraces(task, settings, traceLayer, collarLayer, taskTables), self.addTaskLayers)
+
+    # Build the trace layers of the supplied tables in a background task.
+    # Returns the file names of the layers to be added to the project.
+    def buildDownholeTraces(self, task, settings, traceLayer, collarLayer, tables):
+        # Load all the desurveyed drill traces into memory once, so every interval of every table is positioned
+        # without querying the trace layer again, whatever order the intervals are in.
+        task.setPhase("Loading traces", traceLayer.featureCount())
+        updateInt = max(100, int(traceLayer.featureCount()/100))
+        def progress(index):
+            if index%updateInt == 0:
+                task.setValue(index)
+        traces = TraceCache(traceLayer, progress)
+
+        # End of hole depths for checking the intervals
+        collarDepths = readCollarDepths(collarLayer, settings.collarId, settings.collarDepth)
+
+        fileNames = []
+        for table in tables:
+            # Report any bad intervals in one go before the traces are built
+            task.setPhase("Checking %s intervals in %s" % (table.suffix, table.layer.name()), table.layer.featureCount())
+            fileNames.extend(self.checkDownholeTable(table, settings, traceLayer, collarDepths, task))
+
+            task.setPhase("Building %s traces from %s" % (table.suffix, table.layer.name()), table.layer.featureCount())
+            fileNames.append(self.createDownholeTable(table, settings, traceLayer, traces, task))
+        return fileNames
+
+    # Add the layers written by a task to the project
+    def addTaskLayers(self, fileNames):
+        for fileName in fileNames or []:
+            addLayerFile(fileName)
+
+    # Create the down hole trace layer for one downhole table from the already loaded traces.
+    # Returns the file name of the new layer.
+    def createDownholeTable(self, table, settings, traceLayer, traces, task):
         # Get the fields from the data layer
-        dp = self.dataLayer.dataProvider()
-        idxId = dp.fieldNameIndex(self.dataId)
-        idxFrom = dp.fieldNameIndex(self.dataFrom)
-        idxTo = dp.fieldNameIndex(self.dataTo)
-        # Create a list of attribute indices from the desired attribute field names
-        idxAttList = []
-        for name in self.dataFields:
-            idx = dp.fieldNameIndex(name)
-            idxAttList.append(idx)
-        
-        # Get the fields from the desurveyed trace layer
-        tdp = self.traceLayer.dataProvider()
-        idxTraceId = tdp.fieldNameIndex("CollarID")
-        idxTraceSegLength = tdp.fieldNameIndex("SegLength")
-
-        # Store the relevant desurveyed drill trace so that it's persistent between loops
-        # This way we should be able to re-use it instead of re-fetching it.
-        traceFeature = QgsFeature()
-        currentTraceCollar = ""
-        currentTraceSegLength = 1.0
-        currentTracePolyline = None
+        dataFields = table.layer.fields()
+        idxId = dataFields.lookupField(table.dataId)
+        idxFrom = dataFields.lookupField(table.dataFrom)
+        idxTo = dataFields.lookupField(table.dataTo)
+        # Create a list of attribute indices from the desired attribute field names.
+        # Fields saved in the project may no longer exist in the layer, so they are left out of the output.
+        idxAttList = [idx for idx in (dataFields.lookupField(name) for name in table.fields) if idx > -1]
+
+        # Create the output GeoPackage. Features are written to it in batches as they are built.
+        fileName = downholeFilename(traceLayer, table.suffix)
+        layer = self.createDownholeLayer(table, idxAttList, fileName, traceLayer.sourceCrs())
+        writer = FeatureBatchWriter(layer.dataProvider(), settings.featureBatchSize)
+        # The GeoPackage provider has an fid field ahead of our own fields, which we leave empty
+        composited = table.isComposited()
+        # The segments of the intervals are indexed as they are written
+        segments = SegmentIndexWriter(segmentIndexFilename(fileName))
+        attPrefix = [None] * (layer.fields().count() - len(idxAttList) - 6 - (1 if composited else 0))
+
+        # Settings for compositing the intervals of each hole
+        compositing = None
+        if composited:
+            numeric = [dataFields.at(idx).isNumeric() for idx in idxAttList]
+            boundaries = None
+            if table.compositeMethod == "Layer intervals":
+                boundaries = readIntervalLayer(table.compositeLayer, table.compositeId, table.compositeFrom, table.compositeTo)
+            compositing = (table, numeric, dataFields.count(), boundaries)
         
     #Loop through downhole layer features
         # Calculate an optimum update interval for the progress bar (updating gui items is expensive)
-        updateInt = max(100, long(self.dataLayer.featureCount()/100))
-        for index, df in enumerate(self.dataLayer.getFeatures()):
-            # Update the Progress bar
+        updateInt = max(100, int(table.layer.featureCount()/100))
+        def progress(index):
             if index%updateInt == 0:
-                pd.setValue(index)
-                qApp.processEvents()
+                task.setValue(index)
+        # Only fetch the attributes we use. Geometry isn't needed as positions come from the trace.
+        request = attributeRequest([idxId, idxFrom, idxTo] + idxAttList)
+        # The intervals arrive ordered by hole, so each hole is positioned along its trace once, then released
+        holeId = None
+        holeRows = []
+        for index, (fid, attrs) in enumerate(orderedFeatures(table.layer, request, idxId, idxFrom, settings.sortBufferRows, progress)):
+            # Update the Progress bar
+            progress(index)
             
-            # Variable to hold a feature
-            feature = QgsFeature()
-
-            # get the feature's attributes
-            attrs = df.attributes()
             # Check all the data is valid
             dataId = attrs[idxId]
             dataFrom = attrs[idxFrom]
@@ -302,139 +882,341 @@ class DrillManager:
             if (dataId==NULL) or (dataFrom==NULL) or (dataTo==NULL):
                 continue
             dataId = dataId.strip()
-            
-            # Get the desurvey drill trace relevant to this collar, checking first that we don't already have it
-            if not currentTraceCollar == dataId:
-                # Get the correct trace feature via a query
-                query = '''"CollarID" = '%s' ''' % (dataId)
-                selection = self.traceLayer.getFeatures(QgsFeatureRequest().setFilterExpression(query))
-                # We have a selection of features
-                if selection.isValid():
-                    # There should be just 1, so get the first feature
-                    selection.nextFeature(traceFeature)
-                    # Is the feature valid?
-                    if traceFeature.isValid():
-                        # Update information for the current feature
-                        currentTraceCollar = dataId
-                        currentTraceSegLength = traceFeature.attributes()[idxTraceSegLength]
-                        # The normal asPolyline() function only returns QgsPointXY, yet we need the Z coordinate as well
-                        # We therefore get a vertex iterator for the abstractGeometry and build our own list
-                        currentTracePolyline = []
-                        vi = traceFeature.geometry().vertices()
-                        while vi.hasNext():
-                            currentTracePolyline.append(vi.next())
-                    else:
-                        continue
-                else:
-                    continue
-                
-            # Create line representing the downhole value using From and To
-            pointList = []
-            # Calculate indices spanning the from and to depths, then linearly interpolate a position
-            try:
-                pFrom, iFrom = interpPolyline(dataFrom, currentTraceSegLength, currentTracePolyline)
-            except:
-                self.logFile.write("Error interpolating from polyline for hole: %s From: %f in row: %d.\n" % (dataId, dataFrom, index))
-                continue
 
-            try:
-                pTo, iTo = interpPolyline(dataTo, currentTraceSegLength, currentTracePolyline)
-            except:
-                self.logFile.write("Error interpolating from polyline for hole: %s To: %f in row: %d.\n" % (dataId, dataTo, index))
+            # Starting a new hole, so write the intervals of the previous one
+            if dataId != holeId:
+                self.writeDownholeHole(writer, traces, holeId, holeRows, attPrefix, idxAttList, compositing, segments)
+                holeId = dataId
+                holeRows = []
+            holeRows.append((fid, attrs, dataFrom, dataTo))
+
+        # Write the intervals of the last hole
+        self.writeDownholeHole(writer, traces, holeId, holeRows, attPrefix, idxAttList, compositing, segments)
+
+        # Write any remaining features
+        writer.flush()
+        layer.updateExtents()
+
+        # Save the index of the interval segments next to the layer
+        segments.close()
+        return fileName
+        
+    # Check all the intervals of a downhole table for overlaps, gaps, inverted intervals, intervals past the end
+    # of the hole and hole IDs without a collar. The issues are written to a QA table next to the trace layer.
+    # Returns the file name of the QA table in a list if anything was found, so it can be added to the map.
+    def checkDownholeTable(self, table, settings, traceLayer, collarDepths, task):
+        idxId = table.layer.fields().lookupField(table.dataId)
+        idxFrom = table.layer.fields().lookupField(table.dataFrom)
+        idxTo = table.layer.fields().lookupField(table.dataTo)
+        # Calculate an optimum update interval for the progress bar (updating gui items is expensive)
+        updateInt = max(100, int(table.layer.featureCount()/100))
+
+        # Read just the interval columns of the whole table. Hole IDs are dictionary encoded as they are read.
+        holeNames = ValueDictionary()
+        codes = []
+        fids = []
+        depthFrom = []
+        depthTo = []
+        for index, feature in enumerate(table.layer.getFeatures(attributeRequest([idxId, idxFrom, idxTo]))):
+            if index%updateInt == 0:
+                task.setValue(index)
+            attrs = feature.attributes()
+            if (attrs[idxId]==NULL) or (attrs[idxFrom]==NULL) or (attrs[idxTo]==NULL):
                 continue
+            codes.append(holeNames.encode(attrs[idxId].strip()))
+            fids.append(feature.id())
+            depthFrom.append(attrs[idxFrom])
+            depthTo.append(attrs[idxTo])
+
+        # Number the holes in sorted order of their IDs, as the QA table is ordered by hole
+        holeIds = np.array(holeNames.values, dtype=str)
+        sortedIds = np.argsort(holeIds, kind='stable')
+        rank = np.empty(len(holeIds), dtype=np.int64)
+        rank[sortedIds] = np.arange(len(holeIds))
+        holes = rank[np.array(codes, dtype=np.int64)]
+        holeIds = holeIds[sortedIds]
+        # Without collar depths there is nothing to check orphans and the end of hole against
+        holeDepths = None
+        if collarDepths is not None:
+            holeDepths = np.array([collarDepths.get(holeId, np.nan) for holeId in holeIds.tolist()], dtype=float)
+        rows, issues, issueFrom, issueTo = checkIntervals(holes, depthFrom, depthTo, holeDepths)
+
+        # Write the issues to the QA table, ordered by hole and depth
+        fields = QgsFields()
+        fields.append(QgsField("HoleID",  QVariant.String, "string", 16))
+        fields.append(QgsField("Issue",  QVariant.String, "string", 16))
+        fields.append(QgsField("From",  QVariant.Double, "double", 10, 3))
+        fields.append(QgsField("To",  QVariant.Double, "double", 10, 3))
+        fields.append(QgsField("IssueFrom",  QVariant.Double, "double", 10, 3))
+        fields.append(QgsField("IssueTo",  QVariant.Double, "double", 10, 3))
+        fields.append(QgsField("FeatureID",  QVariant.LongLong, "integer", 10))
+        fileName = downholeFilename(traceLayer, table.suffix + "_QA")
+        layer = createGeoPackageLayer(fileName, fields, QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+        writer = FeatureBatchWriter(layer.dataProvider(), settings.featureBatchSize)
+        attPrefix = [None] * (layer.fields().count() - 7)
+        order = np.lexsort((issueFrom, holes[rows])) if len(rows) > 0 else rows
+        for k in order.tolist():
+            row = rows[k]
+            feature = QgsFeature()
+            feature.setAttributes(attPrefix + [holeNames.decode(codes[row]), qaIssues[issues[k]], float(depthFrom[row]), float(depthTo[row]),
+                                               float(issueFrom[k]), float(issueTo[k]), fids[row]])
+            writer.addFeature(feature)
+        writer.flush()
+
+        # Summarise the issues in the log
+        counts = np.bincount(issues, minlength=len(qaIssues))
+        summary = ", ".join(["%d %s" % (count, issue) for issue, count in zip(qaIssues, counts.tolist()) if count > 0])
+        self.logFile.write("Checked %d %s intervals: %s.\n" % (len(fids), table.suffix, summary if summary else "no issues"))
+        return [fileName] if len(rows) > 0 else []
+
+    # Write the intervals of one hole, compositing them first if compositing settings are supplied.
+    # The sampled length of each composite follows the attributes.
+    # The segments of the intervals are added to the segment index writer.
+    def writeDownholeHole(self, writer, traces, holeId, rows, attPrefix, idxAttList, compositing, segments):
+        if compositing is None:
+            self.writeDownholeIntervals(writer, traces, holeId, rows, attPrefix, idxAttList, segments)
+        elif len(rows) > 0:
+            table, numeric, numFields, boundaries = compositing
+            composites = compositeHole(table, holeId, rows, idxAttList, numeric, numFields, boundaries)
+            self.writeDownholeIntervals(writer, traces, holeId, composites, attPrefix, idxAttList + [numFields], segments, False)
+
+    # Create a 3D point layer from a table of single depth downhole records (eg structures, samples)
+    def createDownholePoints(self):
+        if self.taskRunning():
+            return
+        self.logFile.write("\nCreating Point Layer.\n")
+        self.logFile.flush()
+        
+        # Check that desurvey layer is available
+        if self.traceLayer is None or not self.traceLayer.isValid() or self.pointLayer is None or not self.pointLayer.isValid():
+            return
+
+        # The task reads the layers through thread safe sources. The layer that will be overwritten is removed
+        # from the project before it starts.
+        traceLayer = TaskLayer(self.traceLayer)
+        pointLayer = TaskLayer(self.pointLayer)
+        fileName = downholeFilename(traceLayer, self.pointSuffix)
+        removeLayerFile(fileName)
+
+        settings = TaskSettings(self, self.pointSettings)
+        self.runTask("Build Point Layer", 2,
+                     lambda task: self.buildDownholePoints(task, settings, traceLayer, pointLayer, fileName), self.addTaskLayers)
+
+    # Build the point layer in a background task. Returns the file name of the new layer in a list.
+    def buildDownholePoints(self, task, settings, traceLayer, pointLayer, fileName):
+        # Get the fields from the point layer
+        pointFields = pointLayer.fields()
+        idxId = pointFields.lookupField(settings.pointId)
+        idxDepth = pointFields.lookupField(settings.pointDepth)
+        idxAlpha = pointFields.lookupField(settings.pointAlpha) if settings.pointAlpha else -1
+        idxBeta = pointFields.lookupField(settings.pointBeta) if settings.pointBeta else -1
+        # Oriented core measurements are converted to dip and dip direction if both angles are mapped
+        orientation = (idxAlpha > -1) and (idxBeta > -1)
+        # Create a list of attribute indices from the desired attribute field names, leaving out any that no longer exist
+        idxAttList = [idx for idx in (pointFields.lookupField(name) for name in settings.pointFields) if idx > -1]
+
+        # Create the output GeoPackage. Features are written to it in batches as they are built.
+        layer = self.createDownholePointLayer(pointLayer, idxAttList, orientation, fileName, traceLayer.sourceCrs())
+        writer = FeatureBatchWriter(layer.dataProvider(), settings.featureBatchSize)
+        # The GeoPackage provider has an fid field ahead of our own fields, which we leave empty
+        attPrefix = [None] * (layer.fields().count() - len(idxAttList) - (5 if orientation else 3))
 
-            # Add the first (From) point to the list
-            pointList.append(pFrom)
-            # Add all the intermediate points (so a long interval accurately reflects the bend of the hole)
-            for i in range(math.ceil(iFrom), math.floor(iTo)):
-                pointList.append(currentTracePolyline[i])
-            # Add the last (To) point
-            pointList.append(pTo)
+        # Load all the desurveyed drill traces into memory once
+        task.setPhase("Loading traces", traceLayer.featureCount())
+        updateInt = max(100, int(traceLayer.featureCount()/100))
+        def progress(index):
+            if index%updateInt == 0:
+                task.setValue(index)
+        traces = TraceCache(traceLayer, progress)
+
+        # Calculate an optimum update interval for the progress bar (updating gui items is expensive)
+        task.setPhase("Building points from %s" % (pointLayer.name()), pointLayer.featureCount())
+        updateInt = max(100, int(pointLayer.featureCount()/100))
+        def progress(index):
+            if index%updateInt == 0:
+                task.setValue(index)
+        # Only fetch the attributes we use. Geometry isn't needed as positions come from the trace.
+        request = attributeRequest([idxId, idxDepth, idxAlpha, idxBeta] + idxAttList)
+        # The records arrive ordered by hole, so each hole is positioned along its trace once, then released
+        holeId = None
+        holeRows = []
+        for index, (fid, attrs) in enumerate(orderedFeatures(pointLayer, request, idxId, idxDepth, settings.sortBufferRows, progress)):
+            # Update the Progress bar
+            progress(index)
             
-            # Set the geometry for the new downhole feature
-            feature.setGeometry(QgsGeometry.fromPolyline(pointList))
+            # Check all the data is valid
+            dataId = attrs[idxId]
+            dataDepth = attrs[idxDepth]
+            if (dataId==NULL) or (dataDepth==NULL):
+                continue
+            dataId = dataId.strip()
+            # Missing angles just give an empty dip and dip direction
+            alpha = attrs[idxAlpha] if orientation and attrs[idxAlpha] != NULL else np.nan
+            beta = attrs[idxBeta] if orientation and attrs[idxBeta] != NULL else np.nan
+
+            # Starting a new hole, so write the records of the previous one
+            if dataId != holeId:
+                self.writeDownholePoints(writer, traces, holeId, holeRows, attPrefix, idxAttList, orientation)
+                holeId = dataId
+                holeRows = []
+            holeRows.append((fid, attrs, dataDepth, alpha, beta))
+
+        # Write the records of the last hole
+        self.writeDownholePoints(writer, traces, holeId, holeRows, attPrefix, idxAttList, orientation)
+
+        # Write any remaining features
+        writer.flush()
+        layer.updateExtents()
+        return [fileName]
+
+    # Position a list of (row, attributes, depth, alpha, beta) records from one hole along its trace in a single
+    # vectorised pass, converting alpha and beta to dip and dip direction, and write a point feature for each one.
+    def writeDownholePoints(self, writer, traces, holeId, rows, attPrefix, idxAttList, orientation):
+        # Get the desurvey drill trace relevant to this collar from the cache
+        if len(rows) == 0 or holeId not in traces:
+            return
+
+        depths = np.array([row[2] for row in rows], dtype=float)
+        points, directions, valid = pointTraces(traces.trace(holeId), depths)
+        for (index, attrs, dataDepth, alpha, beta), ok in zip(rows, valid.tolist()):
+            if not ok:
+                self.logFile.write("Error interpolating from polyline for hole: %s Depth: %f in feature: %d.\n" % (holeId, dataDepth, index))
+        validRows = [row for row, ok in zip(rows, valid.tolist()) if ok]
+
+        if orientation:
+            alpha = np.array([row[3] for row in validRows], dtype=float)
+            beta = np.array([row[4] for row in validRows], dtype=float)
+            dip, dipDirection = alphaBetaToDipDirection(directions, alpha, beta)
+            # Unknown orientations are written as empty attributes
+            dip = [None if math.isnan(v) else v for v in dip.tolist()]
+            dipDirection = [None if math.isnan(v) else v for v in dipDirection.tolist()]
+
+        for k, (index, attrs, dataDepth, alpha, beta) in enumerate(validRows):
+            x, y, z, m = points[k].tolist()
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry(QgsPoint(x, y, z, m)))
+
+            # Copy the selected attributes, then append the 3D desurveyed point and the orientation
+            attList = list(attPrefix)
+            for idx in idxAttList:
+                attList.append(attrs[idx])
+            attList.extend([x, y, z])
+            if orientation:
+                attList.extend([dip[k], dipDirection[k]])
+            feature.setAttributes(attList)
+
+            writer.addFeature(feature)
+
+    # Position a list of (row, attributes, from, to) intervals from one hole along its trace in a single
+    # vectorised pass and write a downhole feature for each one.
+    # Composites don't come from a single source feature, so their segments are indexed with a feature ID of -1.
+    def writeDownholeIntervals(self, writer, traces, holeId, rows, attPrefix, idxAttList, segments=None, sourceFeatures=True):
+        # Get the desurvey drill trace relevant to this collar from the cache
+        if len(rows) == 0 or holeId not in traces:
+            return
+
+        depthFrom = np.array([row[2] for row in rows], dtype=float)
+        depthTo = np.array([row[3] for row in rows], dtype=float)
+        points, offsets, valid = intervalTraces(traces.trace(holeId), depthFrom, depthTo)
+        for (index, attrs, dataFrom, dataTo), ok in zip(rows, valid.tolist()):
+            if not ok:
+                self.logFile.write("Error interpolating from polyline for hole: %s From: %f To: %f in feature: %d.\n" % (holeId, dataFrom, dataTo, index))
+
+        # Index the segments of each interval against the feature it came from
+        if segments is not None:
+            fids = [row[0] if sourceFeatures else -1 for row, ok in zip(rows, valid.tolist()) if ok]
+            segments.add(points, offsets, [holeId] * len(fids), fids)
+
+        # Convert to python lists once, then slice out the points of each interval
+        xs, ys, zs, ms = (points[:, i].tolist() for i in range(4))
+        offsets = offsets.tolist()
+        for k, (index, attrs, dataFrom, dataTo) in enumerate(row for row, ok in zip(rows, valid.tolist()) if ok):
+            first = offsets[k]
+            last = offsets[k+1]
+
+            # Create line representing the downhole value using From, the intermediate trace vertices and To
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry(QgsLineString(xs[first:last], ys[first:last], zs[first:last], ms[first:last])))
 
             # Create a list of the attributes to be included in new file
             # These are just copied from the original down hole layer
             # according to whether the user selected the check boxes
-            attList = []
+            attList = list(attPrefix)
             for idx in idxAttList:
                 attList.append(attrs[idx])
 
             # Also append the 3D desurveyed From and To points
-            attList.append(pointList[0].x())
-            attList.append(pointList[0].y())
-            attList.append(pointList[0].z())
-            attList.append(pointList[1].x())
-            attList.append(pointList[1].y())
-            attList.append(pointList[1].z())
+            attList.extend([xs[first], ys[first], zs[first], xs[last-1], ys[last-1], zs[last-1]])
 
             # Set the attributes for the new feature
             feature.setAttributes(attList)
 
             # Add the new feature to the new Trace_ layer
-            layer.startEditing()
-            layer.addFeature(feature)
-            layer.commitChanges()
-
-        # Flush the log file in case anything was written
-        self.logFile.flush()
-        
-        # Build the new filename for saving to disk. We are using GeoPackages
-        base, ext = os.path.splitext(self.traceLayer.dataProvider().dataSourceUri())
-        fileName = uriToFile(base + "_%s" % (self.dataSuffix))
-
-        # Generate a layer label
-        label = os.path.splitext(os.path.basename(fileName))[0]
-
-        # Remove trace layer from project if it already exists
-        oldLayer = getLayerByName(label)
-        QgsProject.instance().removeMapLayer(oldLayer)
-
-        #Save memory layer to Geopackage file
-        error = QgsVectorFileWriter.writeAsVectorFormat(layer, fileName, "CP1250", self.traceLayer.sourceCrs(), layerOptions=['OVERWRITE=YES'])
-            
-        # Load the one we just saved and add it to the map
-        layer = QgsVectorLayer(fileName+".gpkg", label)
-        QgsProject.instance().addMapLayer(layer)
+            writer.addFeature(feature)
         
+    # Desurvey the data in a background task
     def desurveyData(self):
+        if self.taskRunning():
+            return
         # Write to the log file
         self.logFile.write("\nDesurveying data.\n")
         self.logFile.flush()
-        
-        # Set up a progress bar
-        pd = QProgressDialog()
-        pd.setAutoReset(False)
-        pd.setMinimumWidth(500)
-        pd.setMinimum(0)
-        
+        if self.collarLayer is None or not self.collarLayer.isValid():
+            return
+
+        # The task reads the collars and surveys through thread safe sources
+        collarLayer = TaskLayer(self.collarLayer)
+        surveyLayer = TaskLayer(self.surveyLayer) if self.surveyLayer is not None and self.surveyLayer.isValid() else None
+
+        # An existing trace layer is updated in place. Otherwise it is overwritten, so it is removed from the project first.
+        # The removed layer is deleted, so if it was the current trace layer it is forgotten until the task replaces it.
+        fileName = self.createTraceFilename()
+        if not traceLayerUpdatable(fileName):
+            traceLayerId = self.traceLayer.id() if self.traceLayer is not None else None
+            if removeLayerFile(fileName) == traceLayerId:
+                self.traceLayer = None
+
+        settings = TaskSettings(self, self.desurveySettings)
+        self.runTask("Desurvey Data", 5,
+                     lambda task: self.desurveyHoles(task, settings, collarLayer, surveyLayer, fileName), self.desurveyFinished)
+
+    # Add the trace layer to the map so the user can manipulate it, or redraw it if it is already there
+    def desurveyFinished(self, fileName):
+        if fileName is not None:
+            self.traceLayer = addLayerFile(fileName)
+
+    # Desurvey the holes in a background task, writing or updating the trace layer fileName.
+    # Returns the file name of the trace layer.
+    def desurveyHoles(self, task, settings, collarLayer, surveyLayer, fileName):
         # Get the relevant attribute indices
-        dp = self.collarLayer.dataProvider()
-        idxCollarId = dp.fieldNameIndex(self.collarId)
-        idxCollarEast = dp.fieldNameIndex(self.collarEast)
-        idxCollarNorth = dp.fieldNameIndex(self.collarNorth)
-        idxCollarElev = dp.fieldNameIndex(self.collarElev)
-        idxCollarDepth = dp.fieldNameIndex(self.collarDepth)
-        idxCollarAz = dp.fieldNameIndex(self.collarAz)
-        idxCollarDip = dp.fieldNameIndex(self.collarDip)
+        collarFields = collarLayer.fields()
+        idxCollarId = collarFields.lookupField(settings.collarId)
+        idxCollarEast = collarFields.lookupField(settings.collarEast)
+        idxCollarNorth = collarFields.lookupField(settings.collarNorth)
+        idxCollarElev = collarFields.lookupField(settings.collarElev)
+        idxCollarDepth = collarFields.lookupField(settings.collarDepth)
+        idxCollarAz = collarFields.lookupField(settings.collarAz)
+        idxCollarDip = collarFields.lookupField(settings.collarDip)
 
         # Are we using azimuths and dips from the collar file?
         useCollarAzDip = (idxCollarAz > -1) and (idxCollarDip > -1)
         
         # Build Collar array (Id, east, north, elev, eoh, az, dip)
-        numCollars = self.collarLayer.featureCount()
+        numCollars = collarLayer.featureCount()
         arrCollar = []
 
         # Update the progress bar
-        pd.setWindowTitle("Build Collar Array")
-        pd.setMaximum(numCollars)
-        pd.setValue(0)
+        task.setPhase("Build Collar Array", numCollars)
+        #Calculate optimum update interval
+        updateInt = max(100, int(numCollars/100))
         
         # Loop through the collar layer and build list of collars
-        for index, feature in enumerate(self.collarLayer.getFeatures()):
+        # Only fetch the mapped attributes, not the geometry or any other columns
+        request = attributeRequest([idxCollarId, idxCollarEast, idxCollarNorth, idxCollarElev, idxCollarDepth, idxCollarAz, idxCollarDip])
+        for index, feature in enumerate(collarLayer.getFeatures(request)):
             # Update progress bar
-            pd.setValue(index)
+            if index%updateInt == 0:
+                task.setValue(index)
             
             # get the feature's attributes
             attrs = feature.attributes()
@@ -454,58 +1236,72 @@ class DrillManager:
                     c.az = 0.0
                 c.dip = attrs[idxCollarDip]
                 if c.dip==NULL:
-                    c.dip = -90 if self.downDipNegative else 90
+                    c.dip = -90 if settings.downDipNegative else 90
             arrCollar.append(c)
             
-        # Build Survey array (Id, depth, az, dip)
-        arrSurvey = []
-        if self.surveyLayer is not None and self.surveyLayer.isValid():
-            numSurveys = self.surveyLayer.featureCount()
-    
+        # Build Survey columns (Id, depth, az, dip)
+        surveyIds = []
+        surveyDepths = []
+        surveyAzs = []
+        surveyDips = []
+        numSurveys = surveyLayer.featureCount() if surveyLayer is not None else 0
+        task.setPhase("Build Survey Array", numSurveys)
+        if surveyLayer is not None:
             # Get the attribute indices
-            dp = self.surveyLayer.dataProvider()
-            idxSurveyId = dp.fieldNameIndex(self.surveyId)
-            idxSurveyDepth = dp.fieldNameIndex(self.surveyDepth)
-            idxSurveyAz = dp.fieldNameIndex(self.surveyAz)
-            idxSurveyDip = dp.fieldNameIndex(self.surveyDip)
+            surveyFields = surveyLayer.fields()
+            idxSurveyId = surveyFields.lookupField(settings.surveyId)
+            idxSurveyDepth = surveyFields.lookupField(settings.surveyDepth)
+            idxSurveyAz = surveyFields.lookupField(settings.surveyAz)
+            idxSurveyDip = surveyFields.lookupField(settings.surveyDip)
             
             # Update progress bar
-            pd.setWindowTitle("Build Survey Array")
-            pd.setMaximum(numSurveys)
-            pd.setValue(0)
+            updateInt = max(100, int(numSurveys/100))
             #Loop through Survey layer and buils list of surveys
-            for index, feature in enumerate(self.surveyLayer.getFeatures()):
-                pd.setValue(index)
+            request = attributeRequest([idxSurveyId, idxSurveyDepth, idxSurveyAz, idxSurveyDip])
+            for index, feature in enumerate(surveyLayer.getFeatures(request)):
+                if index%updateInt == 0:
+                    task.setValue(index)
                 
                 # get the feature's attributes
                 attrs = feature.attributes()
-                s = Survey()
-                s.id = attrs[idxSurveyId]
-                s.depth = attrs[idxSurveyDepth]
-                s.az = attrs[idxSurveyAz]
-                s.dip = attrs[idxSurveyDip]
-                if (s.id==NULL) or (s.depth==NULL) or (s.az==NULL) or (s.dip==NULL):
+                holeId = attrs[idxSurveyId]
+                depth = attrs[idxSurveyDepth]
+                az = attrs[idxSurveyAz]
+                dip = attrs[idxSurveyDip]
+                if (holeId==NULL) or (depth==NULL) or (az==NULL) or (dip==NULL):
                     continue
-                s.id = s.id.strip()
-                arrSurvey.append(s)
+                surveyIds.append(holeId.strip())
+                surveyDepths.append(depth)
+                surveyAzs.append(az)
+                surveyDips.append(dip)
+
+        # Group the surveys by hole once so each collar can look up its own surveys directly
+        holeSurveys = SurveyIndex(surveyIds, surveyDepths, surveyAzs, surveyDips)
             
-        # Create new layer for the desurveyed 3D coordinates. PolyLine, 1 row per collar, 2 attribute (Id, Segment Length)
-        self.createDesurveyLayer()
-        
         #Loop through collar list and desurvey each one
         # Update Progress bar
-        pd.setWindowTitle("Desurvey Progress")
-        pd.setMaximum(len(arrCollar))
-        pd.setValue(0)
+        task.setPhase("Desurvey Progress", len(arrCollar))
         #Calculate optimum update interval
         updateInt = max(100, int(len(arrCollar)/100))
         
+        # If there is already a trace layer with fingerprints, only holes that have changed are desurveyed again
+        traceLayer, existingTraces = readTraceFingerprints(fileName)
+        fingerprintSettings = (settings.desurveyLength, settings.downDipNegative, settings.vertexTolerance, settings.desurveyMethod)
+        unchangedHoles = set()
+
+        # Flat survey arrays for all holes. Hole n uses surveys surveyOffsets[n] to surveyOffsets[n+1]
+        holeList = []
+        fingerprints = []
+        surveyDepth = []
+        surveyAz = []
+        surveyDip = []
+        surveyOffsets = [0]
+
         # Enter collar loop
         for index, collar in enumerate(arrCollar):
-            pd.setValue(index)
-            # Force update the progress bar visualisation every 1% as it normally only happens in idle time
+            # Update the progress bar every 1%, which also stops here if the task has been canceled
             if index%updateInt == 0:
-                qApp.processEvents()
+                task.setValue(index)
 
             # Check the id exists                
             if not collar.id:
@@ -514,15 +1310,13 @@ class DrillManager:
             #Build array of surveys for this collar, including the top az and dip in collar layer. Repeat last survey at EOH.
             surveys = []
 
-            if len(arrSurvey) > 0:
-                # Harvest surveys for this collar from Survey layer list
-                for survey in arrSurvey:
-                    if survey.id == collar.id:
-                        s = Surveys()
-                        s.depth = survey.depth
-                        s.az = survey.az
-                        s.dip = survey.dip
-                        surveys.append(s)
+            # Harvest surveys for this collar from the survey index. They are already sorted by depth.
+            for depth, az, dip in zip(*holeSurveys.surveys(collar.id)):
+                s = Surveys()
+                s.depth = depth
+                s.az = az
+                s.dip = dip
+                surveys.append(s)
 
             # If the az and dip from the collar are to be used, then insert them at depth 0.0
             # We only do this if there are no surveys from the Survey layer
@@ -538,7 +1332,7 @@ class DrillManager:
                 s = Surveys()
                 s.depth = 0.0
                 s.az = 0.0
-                s.dip = -90 if self.downDipNegative else 90
+                s.dip = -90 if settings.downDipNegative else 90
                 surveys.append(s)
                 
             # Is the hole straight? If so, we can take short cuts
@@ -548,9 +1342,6 @@ class DrillManager:
 
             # We only replicate survey to the beginning and end if the hole is not straight
             if not holeStraight:
-                # Sort the surveys array by depth
-                surveys.sort(key = lambda x: x.depth)                        
-            
                 # If surveys exist, but there isn't one at 0.0, then replicate first survey at 0.0
                 if not surveys[0].depth == 0.0:
                     s = Surveys()
@@ -567,115 +1358,98 @@ class DrillManager:
                     s.dip = surveys[-1].dip
                     surveys.append(s)
                 
-            # Create a quaternion for each survey
-            quat = []
-            for j, s in enumerate(surveys):
-                # Rotate about positive X axis by dip degrees (depends on downDipNegative flag)
-                qdip = Quaternion(axis=[1, 0, 0], degrees=(s.dip  if self.downDipNegative else -s.dip))
-
-                # Rotate about positive Z axis by -Az degrees                        
-                qaz = Quaternion(axis=[0, 0, 1], degrees=-s.az)
-                
-                # Combine the dip and azimuth (order is important!)
-                q = qaz * qdip
-                
-                #Ensure the quaternion rotates the shortest way around. This can go wrong when we cross 0/360 deg.
-                # If the dot product of the quats is negative then it's the wrong way,
-                # so we negate the quat.
-                # But, don't do it on the first one
-                if j > 0:
-                    if np.dot(quat[j-1].elements, q.elements) < 0.0:
-                        q = -q
-                quat.append(q)
-                
-            #Build drill trace every desurveyLength to EOH
-            xs = []
-            if not holeStraight:
-                sz = int(collar.depth / self.desurveyLength) + 1
-                depth = 0.0
-                for d in range(0, sz):
-                    xs.append(depth)
-                    depth += self.desurveyLength
-                if xs[-1] > collar.depth:
-                    xs[-1] = collar.depth
-                if xs[-1] < collar.depth:
-                    xs.append(collar.depth)
-            else:
-                xs.append(0.0)
-                
-            # Create linestring to record the desurveyed points every Segment Length
-            # This can then be used to interpolate intervening points
-            feature = QgsFeature()
-            # We'll create a pointlist to hold all the 3D points
-            pointList = []
-            # We start by adding the collar coordinates
-            pointList.append(QgsPoint(collar.east, collar.north, collar.elev))
-            # It's easier with a straight hole
-            if not holeStraight:
-                # We're going to keep iterating through the survey list looking for the bracketing surveys.
-                # We therefore record the start point of the iteration as it will only go up. Saves time.
-                idx0 = 0
-                # We already added the location at point0 (the collar) so start from 1
-                for i in range(1, len(xs)):
-                    q = Quaternion()
-                    # Find the lowest survey equal or less than xs
-                    for j in range(idx0, len(surveys)):
-                        # Is there a survey exactly at this point?
-                        if surveys[j].depth == xs[i]:
-                            # Update the iteration start point
-                            idx0 = j
-                            q = quat[j]
-                            break
-                        # Are there surveys bracketing this depth? If so, interpolate point
-                        if surveys[j].depth < xs[i] and surveys[j+1].depth >= xs[i]:
-                            # Update the iteration start point
-                            idx0 = j
-                            # How far are we between bracketing surveys?
-                            ratio = (xs[i] - surveys[j].depth) / (surveys[j+1].depth - surveys[j].depth)
-                            # Interpolate between bracketing survey rotations
-                            q = Quaternion.slerp(quat[j], quat[j+1], ratio)
-                            break
-
-                    # Calculate the deviation of this segment of the hole
-                    offset = q.rotate(np.array([0.0, 1.0, 0.0])) * self.desurveyLength
-                    # Calculate the new point by adding the offset to the old point
-                    p0 = pointList[i-1]
-                    pointList.append(QgsPoint(p0.x() + offset[0], p0.y() + offset[1], p0.z() + offset[2]))
-            else:
-                # Calculate the offset of the bottom of hole from the top of hole in a single segment
-                offset = quat[0].rotate(np.array([0.0, 1.0, 0.0])) * collar.depth
-                # Add the offset to the collar
-                p0 = pointList[0]
-                pointList.append(QgsPoint(p0.x() + offset[0], p0.y() + offset[1], p0.z() + offset[2]))
-                
-            # Create new geometry (Polyline) for the feature
-            feature.setGeometry(QgsGeometry.fromPolyline(pointList))
-            # Add in the field attributes
-            feature.setAttributes([collar.id, collar.depth if holeStraight else self.desurveyLength])
-            
-            # Add the feature to the layer
-            self.traceLayer.startEditing()
-            self.traceLayer.addFeature(feature)
-            self.traceLayer.commitChanges()
+            # Skip the hole if its trace was built from exactly the same collar, surveys and settings
+            fingerprint = holeFingerprint(collar.east, collar.north, collar.elev, collar.depth,
+                                          [s.depth for s in surveys], [s.az for s in surveys], [s.dip for s in surveys], fingerprintSettings)
+            if existingTraces is not None and collar.id in existingTraces and existingTraces[collar.id][1] == fingerprint:
+                unchangedHoles.add(collar.id)
+                continue
 
-        fileName = self.createTraceFilename()
+            # Add this hole's surveys to the flat arrays for the desurvey engine
+            holeList.append(collar)
+            fingerprints.append(fingerprint)
+            for s in surveys:
+                surveyDepth.append(s.depth)
+                surveyAz.append(s.az)
+                surveyDip.append(s.dip)
+            surveyOffsets.append(len(surveyDepth))
 
-        # Calculate the filename for the on disk file
-        path="%s.gpkg" % (fileName)
-        
-        # work out a label for the layer from the file name
-        label = os.path.splitext(os.path.basename(fileName))[0]
-        
-        # Remove trace layer from project if it already exists
-        layer = getLayerByName(label)
-        QgsProject.instance().removeMapLayer(layer)
-        
-        #Save memory layer to GeoPackage
-        error = QgsVectorFileWriter.writeAsVectorFormat(self.traceLayer, fileName, "CP1250", self.collarLayer.sourceCrs(), layerOptions=['OVERWRITE=YES'])
+        collars = np.array([[c.east, c.north, c.elev] for c in holeList], dtype=float)
+        depths = np.array([c.depth for c in holeList], dtype=float)
+
+        if existingTraces is None:
+            # Create new layer for the desurveyed 3D coordinates. PolyLine, 1 row per collar, 3 attribute (Id, Segment Length, Fingerprint)
+            # Features are streamed straight into the GeoPackage in batches as they are built.
+            traceLayer = self.createDesurveyLayer(fileName, collarLayer.sourceCrs())
+        else:
+            # Remove the traces of holes that have changed or no longer exist. Changed holes are added again below.
+            staleFids = [fid for holeId, (fid, fingerprint) in existingTraces.items() if holeId not in unchangedHoles]
+            traceLayer.dataProvider().deleteFeatures(staleFids)
+            self.logFile.write("Re-desurveying %d holes, %d unchanged, %d traces removed.\n" % (len(holeList), len(unchangedHoles), len(staleFids)))
+        writer = FeatureBatchWriter(traceLayer.dataProvider(), settings.featureBatchSize)
+        # The GeoPackage provider has an fid field ahead of our own fields, which we leave empty
+        attPrefix = [None] * (traceLayer.fields().count() - 3)
+        # The segments of the traces are indexed as they are written. If only changed holes are desurveyed and
+        # there is no index of the unchanged ones, the index is built from the whole trace layer afterwards instead.
+        indexFile = segmentIndexFilename(fileName)
+        rebuildIndex = existingTraces is not None and not os.path.exists(indexFile)
+        segments = None if rebuildIndex else SegmentIndexWriter(indexFile)
+
+        # Desurvey the holes a chunk at a time, writing the trace features of each chunk before the next one is desurveyed
+        task.setPhase("Desurvey Holes", len(holeList))
+        for first, last, vertices, vertexDepths, vertexOffsets in desurveyHoleChunks(collars, depths, surveyOffsets, surveyDepth, surveyAz, surveyDip, settings.desurveyLength, settings.downDipNegative, settings.vertexTolerance, settings.desurveyMethod, settings.desurveyWorkers):
+            # Create a trace feature for each hole
+            for k in range(last - first):
+                index = first + k
+                if index%updateInt == 0:
+                    task.setValue(index)
+                collar = holeList[index]
 
-        # Load the layer we just saved so the user can manipulate a real layer
-        self.traceLayer = QgsVectorLayer(path, label)
-        QgsProject.instance().addMapLayer(self.traceLayer)
+                # Is the hole straight? If so, it was desurveyed as a single segment
+                holeStraight = (surveyOffsets[index+1] - surveyOffsets[index]) == 1
+
+                # Create linestring from the desurveyed points, with the measured depth of each point as its M value
+                # This can then be used to interpolate intervening points
+                feature = QgsFeature()
+                pts = vertices[vertexOffsets[k]:vertexOffsets[k+1]]
+                ms = vertexDepths[vertexOffsets[k]:vertexOffsets[k+1]]
+                feature.setGeometry(QgsGeometry(QgsLineString(pts[:, 0].tolist(), pts[:, 1].tolist(), pts[:, 2].tolist(), ms.tolist())))
+                # Add in the field attributes. Adaptive traces don't have a constant segment length, so it is left empty.
+                if holeStraight:
+                    segLength = collar.depth
+                elif settings.vertexTolerance > 0.0:
+                    segLength = None
+                else:
+                    segLength = settings.desurveyLength
+                feature.setAttributes(attPrefix + [collar.id, segLength, fingerprints[index]])
+
+                # Add the feature to the layer
+                writer.addFeature(feature)
+
+            # Index the segments of the chunk's traces
+            if segments is not None:
+                segments.add(np.column_stack((vertices, vertexDepths)), vertexOffsets, [c.id for c in holeList[first:last]], [-1] * (last - first))
+
+        # Write any remaining features
+        writer.flush()
+        traceLayer.updateExtents()
+
+        # Save the index of the trace segments next to the trace layer
+        task.setPhase("Index Trace Segments")
+        self.writeTraceIndex(traceLayer, indexFile, segments, None if existingTraces is None else unchangedHoles)
+        return fileName
+
+    # Finish the 3D segment index of the trace layer, from the segments of the holes that were just desurveyed.
+    # When only changed holes were desurveyed, the segments of the unchanged holes are copied from the saved index.
+    # If segments is None there is no saved index, so it is built from every trace in the trace layer.
+    def writeTraceIndex(self, traceLayer, indexFile, segments, unchangedHoles):
+        if segments is None:
+            segments = SegmentIndexWriter(indexFile)
+            for holeId, trace in readTraces(traceLayer):
+                segments.add(trace, [0, len(trace)], [holeId], [-1])
+        elif unchangedHoles is not None:
+            segments.addIndexFile(indexFile, unchangedHoles)
+        segments.close()
 
     def createTraceFilename(self):
         # Build the new filename
@@ -683,52 +1457,65 @@ class DrillManager:
         fileName = uriToFile(base + "_Trace")
         return fileName
     
-    def createDesurveyLayer(self):
-        #Find CRS of collar layer
-        crs = self.collarLayer.sourceCrs()
-        
-        #Create a new memory layer
-        layer = QgsVectorLayer("LineString?crs=EPSG:4326", "gt_Trace", "memory")
-        layer.setCrs(crs)
-        dp = layer.dataProvider()
-        dp.addAttributes([
-            QgsField("CollarID",  QVariant.String, "string", 16),
-            QgsField("SegLength",  QVariant.Double, "double", 5, 2)
-            ])
-        layer.updateFields() # tell the vector layer to fetch changes from the provider
-        self.traceLayer = layer
+    def createDesurveyLayer(self, fileName, crs):
+        fields = QgsFields()
+        fields.append(QgsField("CollarID",  QVariant.String, "string", 16))
+        fields.append(QgsField("SegLength",  QVariant.Double, "double", 5, 2))
+        fields.append(QgsField("Fingerprint",  QVariant.String, "string", 40))
+
+        # Create a new GeoPackage in the CRS of the collar layer. Measured depth is stored in M.
+        return createGeoPackageLayer(fileName, fields, QgsWkbTypes.LineStringZM, crs)
     
-    def createDownholeLayer(self):
-        #Create a new memory layer
-        layer = QgsVectorLayer("LineString?crs=EPSG:4326", "gt_Trace", "memory")
-        layer.setCrs(self.traceLayer.sourceCrs())
-        atts = []
-        # Loop through the list of desired field names that the user checked
-        for field in self.dataLayer.fields():
-            if field.name() in self.dataFields:
-                atts.append(field)
+    # The attribute fields are copied from the data layer in the order of idxAttList, which is the order their values are written
+    def createDownholeLayer(self, table, idxAttList, fileName, crs):
+        fields = QgsFields()
+        # Loop through the desired fields that the user checked
+        dataFields = table.layer.fields()
+        for idx in idxAttList:
+            fields.append(dataFields.at(idx))
+        # Composites also record the length that was sampled
+        if table.isComposited():
+            fields.append(QgsField("_CompLength",  QVariant.Double, "double", 10, 3))
         # Also add fields for the desurveyed coordinates
-        atts.append(QgsField("_From_x",  QVariant.Double, "double", 12, 3))
-        atts.append(QgsField("_From_y",  QVariant.Double, "double", 12, 3))
-        atts.append(QgsField("_From_z",  QVariant.Double, "double", 12, 3))
-        atts.append(QgsField("_To_x",  QVariant.Double, "double", 12, 3))
-        atts.append(QgsField("_To_y",  QVariant.Double, "double", 12, 3))
-        atts.append(QgsField("_To_z",  QVariant.Double, "double", 12, 3))
-        
-        # Add all the attributes to the new layer
-        dp = layer.dataProvider()
-        dp.addAttributes(atts)
-        
-        # Tell the vector layer to fetch changes from the provider
-        layer.updateFields() 
+        fields.append(QgsField("_From_x",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_From_y",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_From_z",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_To_x",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_To_y",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_To_z",  QVariant.Double, "double", 12, 3))
 
-        return layer
+        # Create a new GeoPackage in the CRS of the trace layer, carrying measured depth in M
+        return createGeoPackageLayer(fileName, fields, QgsWkbTypes.LineStringZM, crs)
+
+    def createDownholePointLayer(self, pointLayer, idxAttList, orientation, fileName, crs):
+        fields = QgsFields()
+        # Loop through the desired fields that the user checked, in the order their values are written
+        pointFields = pointLayer.fields()
+        for idx in idxAttList:
+            fields.append(pointFields.at(idx))
+        # Also add fields for the desurveyed coordinates, and the orientation of oriented core measurements
+        fields.append(QgsField("_x",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_y",  QVariant.Double, "double", 12, 3))
+        fields.append(QgsField("_z",  QVariant.Double, "double", 12, 3))
+        if orientation:
+            fields.append(QgsField("_Dip",  QVariant.Double, "double", 5, 1))
+            fields.append(QgsField("_DipDir",  QVariant.Double, "double", 5, 1))
+
+        # Create a new GeoPackage in the CRS of the trace layer, carrying measured depth in M
+        return createGeoPackageLayer(fileName, fields, QgsWkbTypes.PointZM, crs)
 
     # Read all the saved DrillManager parameters from the QGIS project        
     def readProjectData(self):
         self.defaultSectionWidth = readProjectNum("DefaultSectionWidth", 50)
         self.defaultSectionStep= readProjectNum("DefaultSectionStep", 50)
         self.desurveyLength = readProjectNum("DesurveyLength", 1)
+        self.desurveyWorkers = readProjectNum("DesurveyWorkers", 1)
+        self.desurveyMethod = readProjectField("DesurveyMethod")
+        if self.desurveyMethod not in desurveyMethods:
+            self.desurveyMethod = "Tangential"
+        self.vertexTolerance = readProjectDouble("VertexTolerance", 0.0)
+        self.featureBatchSize = readProjectNum("FeatureBatchSize", 10000)
+        self.sortBufferRows = readProjectNum("SortBufferRows", 500000)
         self.downDipNegative = readProjectBool("DownDipNegative", True)
         self.collarLayer = readProjectLayer("CollarLayer")
         self.surveyLayer = readProjectLayer("SurveyLayer")
@@ -749,6 +1536,14 @@ class DrillManager:
         self.dataFrom = readProjectField("DataFrom")
         self.dataTo = readProjectField("DataTo")
         self.dataSuffix = readProjectField("DataSuffix")
+        self.dataTables = readProjectTables("DataTables")
+        self.pointLayer = readProjectLayer("PointLayer")
+        self.pointId = readProjectField("PointID")
+        self.pointDepth = readProjectField("PointDepth")
+        self.pointAlpha = readProjectField("PointAlpha")
+        self.pointBeta = readProjectField("PointBeta")
+        self.pointSuffix = readProjectField("PointSuffix")
+        self.pointFields = []
         
         # Collar layer might have changed, so re-open the log file
         self.openLogFile()
@@ -758,6 +1553,11 @@ class DrillManager:
         writeProjectData("DefaultSectionWidth", self.defaultSectionWidth)
         writeProjectData("DefaultSectionStep", self.defaultSectionStep)
         writeProjectData("DesurveyLength", self.desurveyLength)
+        writeProjectData("DesurveyWorkers", self.desurveyWorkers)
+        writeProjectField("DesurveyMethod", self.desurveyMethod)
+        writeProjectData("VertexTolerance", self.vertexTolerance)
+        writeProjectData("FeatureBatchSize", self.featureBatchSize)
+        writeProjectData("SortBufferRows", self.sortBufferRows)
         writeProjectData("DownDepthNegative", self.downDipNegative)
         writeProjectLayer("CollarLayer", self.collarLayer)
         writeProjectLayer("SurveyLayer", self.surveyLayer)
@@ -778,4 +1578,11 @@ class DrillManager:
         writeProjectField("DataFrom", self.dataFrom)
         writeProjectField("DataTo", self.dataTo)
         writeProjectField("DataSuffix", self.dataSuffix)
+        writeProjectTables("DataTables", self.liveDataTables())
+        writeProjectLayer("PointLayer", self.pointLayer)
+        writeProjectField("PointID", self.pointId)
+        writeProjectField("PointDepth", self.pointDepth)
+        writeProjectField("PointAlpha", self.pointAlpha)
+        writeProjectField("PointBeta", self.pointBeta)
+        writeProjectField("PointSuffix", self.pointSuffix)
     
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ composite
+                              -------------------
+        begin                : 2018-04-13
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Roland Hill / MMG
+        email                : roland.hill@mmg.com
+ ***************************************************************************/
+ Length weighted compositing of downhole intervals. Like the desurvey engine,
+ everything in here works on plain NumPy arrays of a single hole.
+"""
+import numpy as np
+
+# The ways intervals can be composited, in the order they are shown to the user
+compositeMethods = ["None", "Fixed length", "Layer intervals"]
+
+# Fixed length composite intervals covering the supplied samples. Composites are aligned to multiples of
+# the length down from the collar, and the last one stops at the bottom of the deepest sample.
+def fixedLengthIntervals(depthFrom, depthTo, length):
+    depthFrom = np.asarray(depthFrom, dtype=float)
+    depthTo = np.asarray(depthTo, dtype=float)
+    if len(depthFrom) == 0 or length <= 0.0:
+        return np.zeros(0), np.zeros(0)
+
+    start = np.floor(np.min(depthFrom) / length) * length
+    end = np.max(depthTo)
+    # Allow for rounding so an exact multiple doesn't create a sliver at the end
+    count = max(int(np.ceil((end - start) / length - 1e-9)), 0)
+    compFrom = start + np.arange(count) * length
+    compTo = np.minimum(compFrom + length, end)
+    return compFrom, compTo
+
+# Length weighted average of each column of sample values over each composite interval, for one hole.
+# values is an (N,K) array. NaN values are missing, so they don't count towards the length of the composite.
+# Samples that overlap the one above are trimmed, and inverted samples are ignored.
+# Returns the (M,K) composite values (NaN where nothing was sampled) and the (M,K) sampled lengths.
+def compositeIntervals(depthFrom, depthTo, values, compFrom, compTo):
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    compFrom = np.asarray(compFrom, dtype=float)
+    compTo = np.asarray(compTo, dtype=float)
+    numComp = len(compFrom)
+    numCols = values.shape[1]
+    if len(depthFrom) == 0:
+        return np.full((numComp, numCols), np.nan), np.zeros((numComp, numCols))
+
+    # Sort the samples and trim them so the depths only ever increase down the hole
+    order = np.argsort(depthFrom, kind='stable')
+    f = np.asarray(depthFrom, dtype=float)[order]
+    t = np.asarray(depthTo, dtype=float)[order]
+    values = values[order]
+    above = np.maximum.accumulate(np.maximum(t, f))
+    f[1:] = np.maximum(f[1:], above[:-1])
+    t = np.maximum(t, f)
+
+    # Cumulative sampled length and length weighted value at the sample boundaries f0, t0, f1, t1, ...
+    # Both are constant across gaps between samples and linear within each sample.
+    have = ~np.isnan(values)
+    length = (t - f)[:, None] * have
+    knots = np.column_stack((f, t)).ravel()
+    cumLength = np.zeros((len(knots), numCols))
+    cumValue = np.zeros((len(knots), numCols))
+    cumLength[1::2] = np.cumsum(length, axis=0)
+    cumValue[1::2] = np.cumsum(np.where(have, values, 0.0) * length, axis=0)
+    cumLength[2::2] = cumLength[1:-1:2]
+    cumValue[2::2] = cumValue[1:-1:2]
+
+    # Evaluate the cumulative sums at the composite boundaries by linear interpolation between the knots
+    def cumulativeAt(depth):
+        i = np.clip(np.searchsorted(knots, depth, side='right') - 1, 0, len(knots) - 2)
+        span = knots[i + 1] - knots[i]
+        ratio = np.clip(np.divide(depth - knots[i], span, out=np.zeros(len(depth)), where=span > 0.0), 0.0, 1.0)[:, None]
+        return (cumLength[i] + (cumLength[i + 1] - cumLength[i]) * ratio,
+                cumValue[i] + (cumValue[i + 1] - cumValue[i]) * ratio)
+
+    lengthFrom, valueFrom = cumulativeAt(compFrom)
+    lengthTo, valueTo = cumulativeAt(compTo)
+    compLength = lengthTo - lengthFrom
+    compValue = np.divide(valueTo - valueFrom, compLength, out=np.full((numComp, numCols), np.nan), where=compLength > 1e-12)
+    return compValue, compLength
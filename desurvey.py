@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ desurvey
+                              -------------------
+        begin                : 2018-04-13
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Roland Hill / MMG
+        email                : roland.hill@mmg.com
+ ***************************************************************************/
+ Array based desurvey engine. Everything in here works on plain NumPy arrays
+ so it has no dependency on QGIS objects.
+"""
+import numpy as np
+
+import collections
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+import os.path
+import platform
+import sys
+import hashlib
+
+from .quaternion import QuaternionArray
+
+# Below this many holes the cost of starting worker processes outweighs the gain
+minParallelHoles = 1000
+# Roughly how many stations are desurveyed at once. Memory use is proportional to it.
+chunkStations = 100000
+
+# Build an (N,4) array of unit quaternions from arrays of azimuth and dip (degrees).
+# Equivalent to Quaternion(axis=[0,0,1], degrees=-az) * Quaternion(axis=[1,0,0], degrees=dip)
+def surveyQuaternions(az, dip, downDipNegative):
+    az = np.asarray(az, dtype=float)
+    dip = np.asarray(dip, dtype=float)
+    # Half angles of the azimuth rotation (about Z) and dip rotation (about X)
+    halfAz = np.radians(-az) / 2.0
+    halfDip = np.radians(dip if downDipNegative else -dip) / 2.0
+    cAz = np.cos(halfAz)
+    sAz = np.sin(halfAz)
+    cDip = np.cos(halfDip)
+    sDip = np.sin(halfDip)
+    # Expanded Hamilton product of the two single axis rotations (order is important!)
+    quat = np.empty((len(az), 4))
+    quat[:, 0] = cAz * cDip
+    quat[:, 1] = cAz * sDip
+    quat[:, 2] = sAz * sDip
+    quat[:, 3] = sAz * cDip
+    return quat
+
+# Rotate the downhole unit vector by each row of an (N,4) unit quaternion array.
+# This is the middle column of each quaternion's rotation matrix.
+def downholeDirections(quat):
+    w, x, y, z = quat[:, 0], quat[:, 1], quat[:, 2], quat[:, 3]
+    d = np.empty((len(quat), 3))
+    d[:, 0] = 2.0 * (x * y - w * z)
+    d[:, 1] = 1.0 - 2.0 * (x * x + z * z)
+    d[:, 2] = 2.0 * (y * z + w * x)
+    return d
+
+# Lay out the desurvey stations of a batch of holes. Straight holes have a station at the collar and the end of hole.
+# Curved holes have one every desurveyLength from the collar, plus one at the end of hole.
+# Returns the (H+1,) offsets of each hole's stations and the depth of every station.
+def stationLayout(depths, holeStraight, desurveyLength):
+    numHoles = len(depths)
+    numStations = np.full(numHoles, 2, dtype=np.int64)
+    curved = ~holeStraight
+    sz = (depths[curved] / desurveyLength).astype(np.int64) + 1
+    # A station is added at the end of hole unless the regular stations finish exactly on it
+    lastStation = (sz - 1) * desurveyLength
+    numStations[curved] = np.maximum(sz + (lastStation < depths[curved]), 1)
+
+    vertexOffsets = np.zeros(numHoles + 1, dtype=np.int64)
+    np.cumsum(numStations, out=vertexOffsets[1:])
+
+    # Number the stations down each hole, starting at 0 for the collar
+    vertexHole = np.repeat(np.arange(numHoles), numStations)
+    stationNum = np.arange(vertexOffsets[-1]) - vertexOffsets[vertexHole]
+    vertexDepths = stationNum * float(desurveyLength)
+    # Straight holes go directly to the end of hole, and the final station of each hole is clamped to it
+    vertexDepths[stationNum > 0] = np.minimum(vertexDepths, depths[vertexHole])[stationNum > 0]
+    vertexDepths[vertexOffsets[:-1][holeStraight] + 1] = depths[holeStraight]
+    return vertexOffsets, vertexDepths
+
+# Lay out just enough stations for a batch of holes that the chords between them stay within tolerance
+# of the curved path. Each survey interval is split into equal steps, as few as possible while the sagitta
+# of each step's arc (radius = interval length / dogleg) is no more than tolerance. Straight intervals
+# need no stations between their surveys. Returns the same arrays as stationLayout.
+def adaptiveStationLayout(depths, holeStraight, surveyOffsets, surveyDepth, dogleg, tolerance):
+    numHoles = len(depths)
+    surveyHole = np.repeat(np.arange(numHoles), np.diff(surveyOffsets))
+
+    # Every interval between consecutive surveys of a curved hole, as far as the end of hole
+    s = np.arange(max(len(surveyDepth) - 1, 0))
+    hole = surveyHole[s]
+    valid = (hole == surveyHole[s + 1]) & ~holeStraight[hole] & (surveyDepth[s] < surveyDepth[s + 1]) & (surveyDepth[s] < depths[hole])
+    s = s[valid]
+    hole = hole[valid]
+    d0 = surveyDepth[s]
+    full = surveyDepth[s + 1] - d0
+    d1 = np.minimum(surveyDepth[s + 1], depths[hole])
+    length = d1 - d0
+    # The dogleg is spread evenly along the interval, so a truncated interval turns proportionally less
+    beta = dogleg[s] * length / full
+
+    # Largest angle each step may turn through, then the number of steps
+    steps = np.ones(len(s), dtype=np.int64)
+    bent = beta > 1.0e-9
+    radius = length[bent] / beta[bent]
+    maxAngle = 2.0 * np.arccos(np.clip(1.0 - tolerance / radius, -1.0, 1.0))
+    steps[bent] = np.maximum(np.ceil(beta[bent] / maxAngle), 1).astype(np.int64)
+
+    numStations = np.where(holeStraight, 2, 1) + np.bincount(hole, weights=steps, minlength=numHoles).astype(np.int64)
+    vertexOffsets = np.zeros(numHoles + 1, dtype=np.int64)
+    np.cumsum(numStations, out=vertexOffsets[1:])
+
+    vertexDepths = np.zeros(vertexOffsets[-1])
+    vertexDepths[vertexOffsets[:-1][holeStraight] + 1] = depths[holeStraight]
+    # Station k of n (from 1) in each interval is k/n of the way along it.
+    # Intervals are in hole and depth order, so the stations follow on from each collar in sequence.
+    intervalStart = np.zeros(len(s) + 1, dtype=np.int64)
+    np.cumsum(steps, out=intervalStart[1:])
+    stationInterval = np.repeat(np.arange(len(s)), steps)
+    k = np.arange(intervalStart[-1]) - intervalStart[stationInterval] + 1
+    holeStart = np.searchsorted(hole, np.arange(numHoles))
+    rows = vertexOffsets[hole[stationInterval]] + np.arange(intervalStart[-1]) - intervalStart[holeStart[hole[stationInterval]]] + 1
+    # The last station of each interval is exactly on its end
+    vertexDepths[rows] = np.where(k == steps[stationInterval], d1[stationInterval], d0[stationInterval] + length[stationInterval] * k / steps[stationInterval])
+    return vertexOffsets, vertexDepths
+
+# Find the bracketing entries of every supplied depth in one search.
+# sortedDepth holds a depth sorted list for each hole, hole h using entries offsets[h]:offsets[h+1]
+# (eg the surveys or trace vertices of a batch of holes).
+# Returns the index of the first entry of the hole at or below each depth, so the depth lies in the interval
+# that ends there. Depths must be below the first and no deeper than the last entry of their hole.
+def bracketDepths(offsets, sortedDepth, holes, xs):
+    # Depths are replaced by their rank among the sorted depths and combined with the hole number,
+    # giving an exact integer key that sorts by hole then depth.
+    uniqueDepth = np.unique(sortedDepth)
+    scale = len(uniqueDepth) + 1
+    entryHole = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+    entryKey = entryHole * scale + np.searchsorted(uniqueDepth, sortedDepth)
+    key = holes * scale + np.searchsorted(uniqueDepth, xs)
+    return np.searchsorted(entryKey, key, side='left')
+
+# Accumulate rows of offsets down each hole, in place. Hole h uses rows offsets[h]:offsets[h+1].
+# One cumulative sum runs over every hole, then the running total before each hole is taken off its rows.
+# The first row of each hole (eg a collar) is left out of the running total and added back afterwards,
+# so large coordinates don't build up and lose precision over many holes.
+def cumsumByHole(rows, offsets):
+    counts = np.diff(offsets)
+    start = offsets[:-1][counts > 0]
+    counts = counts[counts > 0]
+    first = rows[start].copy()
+    rows[start] = 0.0
+    np.cumsum(rows, axis=0, out=rows)
+    rows -= np.repeat(rows[start] - first, counts, axis=0)
+    return rows
+
+# Linearly interpolate positions at any depths down a batch of desurveyed traces.
+# Depths outside a trace are clamped to its ends.
+def interpolateTraces(vertices, vertexDepths, vertexOffsets, holes, xs):
+    holes = np.asarray(holes, dtype=np.int64)
+    xs = np.asarray(xs, dtype=float)
+    first = vertexOffsets[holes]
+    last = vertexOffsets[holes + 1] - 1
+    j1 = np.clip(bracketDepths(vertexOffsets, vertexDepths, holes, xs), first + 1, last)
+    j0 = np.maximum(j1 - 1, first)
+    span = vertexDepths[j1] - vertexDepths[j0]
+    ratio = np.clip((xs - vertexDepths[j0]) / np.where(span > 0.0, span, 1.0), 0.0, 1.0)
+    return vertices[j0] + (vertices[j1] - vertices[j0]) * ratio[:, np.newaxis]
+
+# Desurvey a batch of holes in one pass by interpolating the orientation at each station and
+# stepping to it in that direction (tangential method).
+#   collars:        (H,3) array of collar east, north, elevation
+#   depths:         (H,) array of end of hole depths
+#   surveyOffsets:  (H+1,) offsets into the survey arrays. Hole h uses rows surveyOffsets[h]:surveyOffsets[h+1]
+#   surveyDepth, surveyAz, surveyDip: flat survey arrays. A hole with a single survey is treated as straight,
+#                   otherwise its surveys must be sorted by depth, start at 0.0 and reach the end of hole.
+#   tolerance:      if more than 0, vertices are only placed where needed to stay within this distance of the
+#                   desurveyed path (see adaptiveStationLayout), instead of every desurveyLength.
+# Returns a (V,3) array of trace vertices, the depth down the hole of each vertex,
+# and the (H+1,) offsets of each hole's vertices within them.
+def desurveyHoles(collars, depths, surveyOffsets, surveyDepth, surveyAz, surveyDip, desurveyLength, downDipNegative, tolerance=0.0):
+    collars = np.asarray(collars, dtype=float).reshape(-1, 3)
+    depths = np.asarray(depths, dtype=float)
+    surveyOffsets = np.asarray(surveyOffsets, dtype=np.int64)
+    surveyDepth = np.asarray(surveyDepth, dtype=float)
+
+    quat = surveyQuaternions(surveyAz, surveyDip, downDipNegative)
+    holeStraight = np.diff(surveyOffsets) == 1
+    vertexOffsets, vertexDepths = stationLayout(depths, holeStraight, desurveyLength)
+
+    vertices = np.empty((vertexOffsets[-1], 3))
+    # The first vertex of every hole is the collar
+    vertices[vertexOffsets[:-1]] = collars
+
+    # Each row holds the offset from the previous vertex
+    # Straight holes are a single segment from the collar to the end of hole
+    straight = np.flatnonzero(holeStraight)
+    vertices[vertexOffsets[straight] + 1] = downholeDirections(quat[surveyOffsets[straight]]) * depths[straight][:, np.newaxis]
+
+    # Every station below the collar of the curved holes
+    vertexHole = np.repeat(np.arange(len(depths)), np.diff(vertexOffsets))
+    stationRow = np.flatnonzero(~holeStraight[vertexHole])
+    stationRow = stationRow[stationRow != vertexOffsets[vertexHole[stationRow]]]
+    if len(stationRow) > 0:
+        xs = vertexDepths[stationRow]
+        j1 = bracketDepths(surveyOffsets, surveyDepth, vertexHole[stationRow], xs)
+        j0 = j1 - 1
+        # How far each station is between its bracketing surveys
+        ratio = (xs - surveyDepth[j0]) / (surveyDepth[j1] - surveyDepth[j0])
+        q = QuaternionArray.slerp(quat[j0], quat[j1], ratio).q
+        # Each segment runs from the station above in the direction of the orientation at its lower station.
+        # They are desurveyLength long, except the last one of each hole which stops at the end of hole.
+        step = xs - vertexDepths[stationRow - 1]
+        vertices[stationRow] = downholeDirections(q) * step[:, np.newaxis]
+
+    # Accumulate the offsets down each hole to get the positions
+    cumsumByHole(vertices, vertexOffsets)
+
+    if tolerance > 0.0:
+        # Resample the full trace at just the stations needed to stay within tolerance
+        dogleg = minimumCurvatureIntervals(surveyAz, surveyDip, downDipNegative)[1]
+        adaptiveOffsets, adaptiveDepths = adaptiveStationLayout(depths, holeStraight, surveyOffsets, surveyDepth, dogleg, tolerance)
+        adaptiveHole = np.repeat(np.arange(len(depths)), np.diff(adaptiveOffsets))
+        vertices = interpolateTraces(vertices, vertexDepths, vertexOffsets, adaptiveHole, adaptiveDepths)
+        vertexDepths = adaptiveDepths
+        vertexOffsets = adaptiveOffsets
+
+    return vertices, vertexDepths, vertexOffsets
+
+# Minimum curvature geometry of the interval from each survey to the next one.
+# Each interval is a circular arc joining the two survey directions. Returns the downhole direction at each
+# survey, the dogleg angle of each interval and the unit normal pointing from the start direction
+# towards the end direction in the plane of the arc. The last survey of each hole has no interval.
+def minimumCurvatureIntervals(surveyAz, surveyDip, downDipNegative):
+    t = downholeDirections(surveyQuaternions(surveyAz, surveyDip, downDipNegative))
+    t0 = t[:-1]
+    t1 = t[1:]
+    cosDogleg = np.clip(np.einsum('ij,ij->i', t0, t1), -1.0, 1.0)
+    dogleg = np.arccos(cosDogleg)
+    sinDogleg = np.sin(dogleg)
+    # The normal is undefined for a straight interval (and a complete reversal), where it isn't needed anyway
+    curved = sinDogleg > 1.0e-12
+    normal = np.zeros_like(t0)
+    normal[curved] = (t1[curved] - cosDogleg[curved][:, np.newaxis] * t0[curved]) / sinDogleg[curved][:, np.newaxis]
+    return t, np.append(dogleg, 0.0), np.vstack((normal, np.zeros((1, 3))))
+
+# Offsets along minimum curvature arcs, a distance s into intervals of length
+# `length` that start in direction t0 and turn through `dogleg` towards `normal`.
+def arcOffsets(t0, normal, dogleg, length, s):
+    offsets = t0 * s[:, np.newaxis]
+    # Straight intervals are a line. Otherwise the arc has radius length / dogleg.
+    curved = dogleg > 1.0e-9
+    radius = length[curved] / dogleg[curved]
+    angle = dogleg[curved] * s[curved] / length[curved]
+    offsets[curved] = radius[:, np.newaxis] * (np.sin(angle)[:, np.newaxis] * t0[curved] + (1.0 - np.cos(angle))[:, np.newaxis] * normal[curved])
+    return offsets
+
+# Positions of the surveys of a batch of holes using the minimum curvature method.
+# Each interval's displacement is (t0 + t1) * length / 2 scaled by the ratio factor 2 / dogleg * tan(dogleg / 2).
+def minimumCurvatureSurveyPositions(collars, surveyOffsets, surveyDepth, t, dogleg):
+    length = np.diff(surveyDepth)
+    half = dogleg[:-1] / 2.0
+    ratioFactor = np.ones_like(half)
+    curved = half > 1.0e-9
+    ratioFactor[curved] = np.tan(half[curved]) / half[curved]
+    positions = np.empty((len(surveyDepth), 3))
+    positions[1:] = (t[:-1] + t[1:]) * (length * ratioFactor / 2.0)[:, np.newaxis]
+    # The first survey of each hole is at the collar
+    positions[surveyOffsets[:-1]] = collars
+    return cumsumByHole(positions, surveyOffsets)
+
+# Positions at any depths down a batch of holes using the minimum curvature method.
+# Arguments are as for desurveyHoles (without the end of hole depths and desurvey length), plus the
+# hole number and depth of each required position.
+# Positions are exact on the minimum curvature path, so any depths can be asked for on demand.
+def minimumCurvaturePositions(collars, surveyOffsets, surveyDepth, surveyAz, surveyDip, downDipNegative, holes, xs):
+    collars = np.asarray(collars, dtype=float).reshape(-1, 3)
+    surveyOffsets = np.asarray(surveyOffsets, dtype=np.int64)
+    surveyDepth = np.asarray(surveyDepth, dtype=float)
+    holes = np.asarray(holes, dtype=np.int64)
+    xs = np.asarray(xs, dtype=float)
+
+    t, dogleg, normal = minimumCurvatureIntervals(surveyAz, surveyDip, downDipNegative)
+    surveyPositions = minimumCurvatureSurveyPositions(collars, surveyOffsets, surveyDepth, t, dogleg)
+
+    positions = np.empty((len(xs), 3))
+    # Straight holes (and the collar itself) only need their first survey direction
+    first = surveyOffsets[holes]
+    straight = (np.diff(surveyOffsets)[holes] == 1) | (xs <= surveyDepth[first])
+    positions[straight] = collars[holes[straight]] + t[first[straight]] * xs[straight][:, np.newaxis]
+
+    curved = np.flatnonzero(~straight)
+    if len(curved) > 0:
+        j0 = bracketDepths(surveyOffsets, surveyDepth, holes[curved], xs[curved]) - 1
+        length = surveyDepth[j0 + 1] - surveyDepth[j0]
+        positions[curved] = surveyPositions[j0] + arcOffsets(t[j0], normal[j0], dogleg[j0], length, xs[curved] - surveyDepth[j0])
+    return positions
+
+# Desurvey a batch of holes in one pass using the minimum curvature method.
+# Takes the same arguments and returns the same arrays as desurveyHoles, with vertices at the same stations.
+# Every vertex lies exactly on the minimum curvature path, so accuracy does not depend on desurveyLength.
+def desurveyHolesMinCurve(collars, depths, surveyOffsets, surveyDepth, surveyAz, surveyDip, desurveyLength, downDipNegative, tolerance=0.0):
+    depths = np.asarray(depths, dtype=float)
+    surveyOffsets = np.asarray(surveyOffsets, dtype=np.int64)
+    surveyDepth = np.asarray(surveyDepth, dtype=float)
+
+    holeStraight = np.diff(surveyOffsets) == 1
+    if tolerance > 0.0:
+        dogleg = minimumCurvatureIntervals(surveyAz, surveyDip, downDipNegative)[1]
+        vertexOffsets, vertexDepths = adaptiveStationLayout(depths, holeStraight, surveyOffsets, surveyDepth, dogleg, tolerance)
+    else:
+        vertexOffsets, vertexDepths = stationLayout(depths, holeStraight, desurveyLength)
+
+    vertexHole = np.repeat(np.arange(len(depths)), np.diff(vertexOffsets))
+    vertices = minimumCurvaturePositions(collars, surveyOffsets, surveyDepth, surveyAz, surveyDip, downDipNegative, vertexHole, vertexDepths)
+    return vertices, vertexDepths, vertexOffsets
+
+# The available desurvey methods, by the name shown to the user
+desurveyMethods = {
+    "Tangential": desurveyHoles,
+    "Minimum Curvature": desurveyHolesMinCurve,
+    }
+
+# The Python interpreter to start worker processes with, or None if there isn't one.
+# Inside QGIS sys.executable is usually the QGIS application itself, so look for the Python it is running.
+def pythonExecutable():
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    if platform.system() == 'Windows':
+        candidates = [os.path.join(sys.exec_prefix, 'pythonw.exe'), os.path.join(sys.exec_prefix, 'python.exe')]
+    else:
+        candidates = [os.path.join(sys.exec_prefix, 'bin', 'python%d.%d' % sys.version_info[:2]),
+                      os.path.join(sys.exec_prefix, 'bin', 'python3')]
+    for python in candidates:
+        if os.path.exists(python):
+            return python
+    return None
+
+# Worker process entry point. Unpacks a chunk of holes and desurveys it.
+def desurveyChunk(args):
+    return desurveyMethods[args[0]](*args[1:])
+
+# Desurvey a batch of holes a chunk of consecutive holes at a time, optionally across a pool of worker processes.
+# Takes the same arguments as desurveyHoles, plus the name of the desurvey method and the number of worker processes.
+# Yields (a, b, vertices, vertexDepths, vertexOffsets) for holes a to b-1 in hole order, the arrays being those
+# desurveyHoles returns for just those holes. Chunks hold roughly chunkStations stations, so memory use doesn't
+# grow with the number of holes as long as each chunk is released before the next one is taken.
+def desurveyHoleChunks(collars, depths, surveyOffsets, surveyDepth, surveyAz, surveyDip, desurveyLength, downDipNegative, tolerance, method, workers):
+    collars = np.asarray(collars, dtype=float).reshape(-1, 3)
+    depths = np.asarray(depths, dtype=float)
+    surveyOffsets = np.asarray(surveyOffsets, dtype=np.int64)
+    surveyDepth = np.asarray(surveyDepth, dtype=float)
+    surveyAz = np.asarray(surveyAz, dtype=float)
+    surveyDip = np.asarray(surveyDip, dtype=float)
+    numHoles = len(depths)
+    if numHoles == 0:
+        return
+    parallel = workers > 1 and numHoles >= minParallelHoles
+
+    # Split where the cumulative station count crosses equal fractions. Several chunks per worker keeps
+    # them all busy when some chunks are slower than others.
+    cumStations = np.cumsum(np.maximum(depths, 0.0) / desurveyLength + 2.0)
+    numChunks = max(int(np.ceil(cumStations[-1] / chunkStations)), workers * 4 if parallel else 1)
+    numChunks = min(numHoles, numChunks)
+    bounds = np.searchsorted(cumStations, np.linspace(0.0, cumStations[-1], numChunks + 1)[1:-1])
+    bounds = np.unique(np.concatenate(([0], bounds, [numHoles])))
+    numChunks = len(bounds) - 1
+
+    # The arguments of chunk k, as plain arrays
+    def chunk(k):
+        a = bounds[k]
+        b = bounds[k+1]
+        s0 = surveyOffsets[a]
+        s1 = surveyOffsets[b]
+        return (method, collars[a:b], depths[a:b], surveyOffsets[a:b+1] - s0,
+                surveyDepth[s0:s1], surveyAz[s0:s1], surveyDip[s0:s1], desurveyLength, downDipNegative, tolerance)
+
+    # Always start fresh interpreters rather than forking the host application.
+    # Only a couple of chunks per worker are queued at once, so finished chunks don't pile up waiting to be taken.
+    # If no interpreter can be found, or the workers can't be started, the remaining chunks are desurveyed here instead.
+    done = 0
+    python = pythonExecutable() if parallel else None
+    if python is not None:
+        context = multiprocessing.get_context("spawn")
+        context.set_executable(python)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                pending = collections.deque()
+                while done < numChunks:
+                    while done + len(pending) < numChunks and len(pending) < workers * 2:
+                        pending.append(pool.submit(desurveyChunk, chunk(done + len(pending))))
+                    vertices, vertexDepths, vertexOffsets = pending.popleft().result()
+                    yield bounds[done], bounds[done+1], vertices, vertexDepths, vertexOffsets
+                    done += 1
+        except (concurrent.futures.process.BrokenProcessPool, OSError):
+            pass
+    for k in range(done, numChunks):
+        vertices, vertexDepths, vertexOffsets = desurveyChunk(chunk(k))
+        yield bounds[k], bounds[k+1], vertices, vertexDepths, vertexOffsets
+
+# Survey table grouped by hole ID, with each hole's surveys sorted by depth.
+# Built once in O(n log n) so any per-hole lookup is a dictionary access instead of a scan of the whole table.
+class SurveyIndex:
+    def __init__(self, ids, depth, az, dip):
+        ids = np.asarray(ids, dtype=str)
+        depth = np.asarray(depth, dtype=float)
+        # Number each distinct hole ID, then sort by hole number and depth together
+        holeIds, holeNum = np.unique(ids, return_inverse=True)
+        order = np.lexsort((depth, holeNum))
+        self.depth = depth[order]
+        self.az = np.asarray(az, dtype=float)[order]
+        self.dip = np.asarray(dip, dtype=float)[order]
+        # The sorted rows of each hole are contiguous, so just record where each hole starts and ends
+        bounds = np.searchsorted(holeNum[order], np.arange(len(holeIds) + 1))
+        self.index = {holeId: (bounds[i], bounds[i+1]) for i, holeId in enumerate(holeIds.tolist())}
+
+    def __contains__(self, holeId):
+        return holeId in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    # The hole IDs present in the survey table
+    def holeIds(self):
+        return self.index.keys()
+
+    # Return the (depth, az, dip) arrays for the supplied hole, sorted by depth. Empty if there are no surveys.
+    def surveys(self, holeId):
+        start, end = self.index.get(holeId, (0, 0))
+        return self.depth[start:end], self.az[start:end], self.dip[start:end]
+
+# Measured depth of each vertex of a trace that doesn't store it. With a constant segment length the
+# vertices are evenly spaced, otherwise the depth is the 3D length along the trace.
+def traceMeasures(points, segLength):
+    if segLength:
+        return np.arange(len(points)) * float(segLength)
+    measures = np.zeros(len(points))
+    if len(points) > 1:
+        np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1), out=measures[1:])
+    return measures
+
+# Position a batch of downhole intervals along a single trace, given as an (N,4) array of x, y, z and measured depth.
+# The From and To points are interpolated on the measured depths, and every trace vertex strictly between them
+# is included so a long interval accurately reflects the bend of the hole.
+# Returns the (P,4) points of the intervals lying within the trace end to end, offsets such that valid interval k
+# is points[offsets[k]:offsets[k+1]], and the mask of intervals lying within the trace.
+def intervalTraces(trace, depthFrom, depthTo):
+    depthFrom = np.asarray(depthFrom, dtype=float)
+    depthTo = np.asarray(depthTo, dtype=float)
+    # No interval lies within an empty trace
+    if len(trace) == 0:
+        return np.zeros((0, 4)), np.zeros(1, dtype=np.int64), np.zeros(len(depthFrom), dtype=bool)
+    measures = trace[:, 3]
+    valid = (np.minimum(depthFrom, depthTo) >= measures[0]) & (np.maximum(depthFrom, depthTo) <= measures[-1])
+    depthFrom = depthFrom[valid]
+    depthTo = depthTo[valid]
+
+    # The vertices strictly between From and To. Inverted intervals just get a straight line.
+    first = np.searchsorted(measures, depthFrom, side='right')
+    last = np.maximum(np.searchsorted(measures, depthTo, side='left'), first)
+    inner = last - first
+    offsets = np.zeros(len(inner) + 1, dtype=np.int64)
+    np.cumsum(inner + 2, out=offsets[1:])
+    points = np.empty((offsets[-1], 4))
+
+    # From and To points of every interval
+    for depths, rows in ((depthFrom, offsets[:-1]), (depthTo, offsets[1:] - 1)):
+        for c in range(3):
+            points[rows, c] = np.interp(depths, measures, trace[:, c])
+        points[rows, 3] = depths
+
+    # Copy the intermediate vertices of every interval in one go
+    innerStart = np.cumsum(inner) - inner
+    src = np.arange(inner.sum()) + np.repeat(first - innerStart, inner)
+    points[src + np.repeat(offsets[:-1] + 1 - first, inner)] = trace[src]
+    return points, offsets, valid
+
+# Position a batch of downhole point records (single depths) along a single trace, given as an (N,4) array of
+# x, y, z and measured depth.
+# Returns the (K,4) points of the records lying within the trace, the unit downhole direction of the trace
+# at each of them, and the mask of records lying within the trace.
+def pointTraces(trace, depths):
+    depths = np.asarray(depths, dtype=float)
+    # No record lies within an empty trace
+    if len(trace) == 0:
+        return np.zeros((0, 4)), np.zeros((0, 3)), np.zeros(len(depths), dtype=bool)
+    measures = trace[:, 3]
+    valid = (depths >= measures[0]) & (depths <= measures[-1])
+    depths = depths[valid]
+
+    points = np.empty((len(depths), 4))
+    for c in range(3):
+        points[:, c] = np.interp(depths, measures, trace[:, c])
+    points[:, 3] = depths
+
+    # Direction of the trace segment each point lies on. A trace with a single vertex has no direction.
+    directions = np.full((len(depths), 3), np.nan)
+    if len(trace) > 1:
+        seg = np.clip(np.searchsorted(measures, depths, side='right') - 1, 0, len(trace) - 2)
+        delta = trace[seg + 1, :3] - trace[seg, :3]
+        length = np.linalg.norm(delta, axis=1)
+        np.divide(delta, length[:, None], out=directions, where=length[:, None] > 0.0)
+    return points, directions, valid
+
+# Convert oriented core alpha and beta angles (degrees) to the dip and dip direction (degrees) of the planes,
+# given the unit downhole direction of the hole at each measurement.
+# Alpha is the angle between the core axis and the plane. Beta is measured clockwise, looking down the hole,
+# from the bottom of hole line to the downhole end of the long axis of the plane's ellipse.
+# Vertical holes have no bottom of hole line, so their results are NaN.
+def alphaBetaToDipDirection(directions, alpha, beta):
+    d = np.asarray(directions, dtype=float)
+    alpha = np.radians(np.asarray(alpha, dtype=float))[:, None]
+    beta = np.radians(np.asarray(beta, dtype=float))[:, None]
+
+    # Bottom of hole line: the part of straight down that is perpendicular to the hole
+    bottom = np.zeros_like(d)
+    bottom[:, 2] = -1.0
+    bottom -= np.sum(bottom * d, axis=1, keepdims=True) * d
+    length = np.linalg.norm(bottom, axis=1, keepdims=True)
+    bottom = np.divide(bottom, length, out=np.full_like(bottom, np.nan), where=length > 1e-9)
+    # Completes the core frame so that angles increase clockwise looking down the hole
+    side = np.cross(d, bottom)
+
+    # Rotate by beta around the core to the downhole end of the ellipse, then by alpha to the pole of the plane
+    ellipse = np.cos(beta) * bottom + np.sin(beta) * side
+    pole = np.sin(alpha) * d - np.cos(alpha) * ellipse
+    # Use the upward pole, as its horizontal part then points in the dip direction
+    pole[pole[:, 2] < 0.0] *= -1.0
+
+    dip = np.degrees(np.arccos(np.clip(pole[:, 2], -1.0, 1.0)))
+    dipDirection = np.degrees(np.arctan2(pole[:, 0], pole[:, 1])) % 360.0
+    return dip, dipDirection
+
+# Content fingerprint of everything that determines a hole's trace: the collar position and depth,
+# the hole's surveys (as passed to the desurvey engine) and the desurvey settings.
+# Values are converted to float first so that eg 100 and 100.0 give the same fingerprint.
+def holeFingerprint(east, north, elev, depth, surveyDepth, surveyAz, surveyDip, settings):
+    values = [float(east), float(north), float(elev), float(depth)]
+    for d, a, i in zip(surveyDepth, surveyAz, surveyDip):
+        values.extend((float(d), float(a), float(i)))
+    return hashlib.sha1(repr((values, settings)).encode("utf-8")).hexdigest()
@@ -0,0 +1,68 @@
+import os
+
+from PyQt5 import QtCore, uic
+from PyQt5 import QtWidgets
+
+from qgis.core import *
+from qgis.utils import *
+from qgis.gui import *
+
+from .dialogBase import dialogBase
+
+FORM_CLASS, _ = uic.loadUiType(os.path.join(
+    os.path.dirname(__file__), 'drillpoint_dialog_base.ui'))
+
+
+class DrillPointDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
+    def __init__(self, manager, parent=None):
+        """Constructor."""
+        super(DrillPointDialog, self).__init__(parent)
+        
+        # Keep a reference to the DrillManager
+        self.drillManager = manager
+        
+        # Set up the user interface from Designer.
+        self.setupUi(self)
+    
+        self.lbDataLayer.setFilters(QgsMapLayerProxyModel.NoGeometry)
+        self.initLayer(self.drillManager.pointLayer, self.lbDataLayer, ["struct", "sample", "point"])
+        self.checkSelectAll.setChecked(True)
+        
+        self.lbDataLayer.layerChanged.connect(self.onDataLayerChanged)
+        self.checkSelectAll.toggled.connect(self.onSelectAllChecked)
+
+        self.onDataLayerChanged()
+        self.teSuffix.setText(self.drillManager.pointSuffix)
+
+    def onDataLayerChanged(self):
+        layer = self.lbDataLayer.currentLayer()
+        if layer is not None and layer.isValid():
+            self.fbDataId.setLayer(layer)
+            self.initField(self.drillManager.pointId, self.fbDataId, ["holeid", "id", "hole", "name"])
+            self.fbDataDepth.setLayer(layer)
+            self.initField(self.drillManager.pointDepth, self.fbDataDepth, ["depth", "from", "md"])
+            self.fbDataAlpha.setLayer(layer)
+            self.initField(self.drillManager.pointAlpha, self.fbDataAlpha, ["alpha"])
+            self.fbDataBeta.setLayer(layer)
+            self.initField(self.drillManager.pointBeta, self.fbDataBeta, ["beta"])
+            #Clear the Suffix text
+            self.teSuffix.clear()
+            #Load the list widget
+            self.listFields.clear()
+            for field in layer.fields():
+                item = QtWidgets.QListWidgetItem()
+                item.setText(field.name())
+                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+                item.setCheckState(QtCore.Qt.Checked)
+                self.listFields.addItem(item)
+        else:
+            self.fbDataId.setCurrentIndex(-1)
+            self.fbDataDepth.setCurrentIndex(-1)
+            self.fbDataAlpha.setCurrentIndex(-1)
+            self.fbDataBeta.setCurrentIndex(-1)
+            self.listFields.clear()
+
+    def onSelectAllChecked(self):
+        state = QtCore.Qt.Checked if self.checkSelectAll.isChecked() else QtCore.Qt.Unchecked
+        for index in range(self.listFields.count()):
+            self.listFields.item(index).setCheckState(state)
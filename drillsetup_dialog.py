@@ -8,6 +8,7 @@ from qgis.utils import *
 from qgis.gui import *
 
 from .dialogBase import dialogBase
+from .desurvey import desurveyMethods
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'drillsetup_dialog_base.ui'))
@@ -36,6 +37,10 @@ class DrillSetupDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
         self.teDefaultSectionWidth.setText(str(self.drillManager.defaultSectionWidth))
         self.teDefaultSectionStep.setText(str(self.drillManager.defaultSectionStep))
         self.sbDesurveyLength.setValue(self.drillManager.desurveyLength)
+        self.sbDesurveyWorkers.setValue(self.drillManager.desurveyWorkers)
+        self.cbDesurveyMethod.addItems(list(desurveyMethods.keys()))
+        self.cbDesurveyMethod.setCurrentText(self.drillManager.desurveyMethod)
+        self.sbVertexTolerance.setValue(self.drillManager.vertexTolerance)
         self.initLayer(self.drillManager.collarLayer, self.lbCollarLayer, ["collar", "hole"])
         self.initLayer(self.drillManager.surveyLayer, self.lbSurveyLayer, ["survey"])
     
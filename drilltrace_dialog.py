@@ -9,11 +9,50 @@ from qgis.utils import *
 from qgis.gui import *
 
 from .dialogBase import dialogBase
+from .composite import compositeMethods
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'drilltrace_dialog_base.ui'))
 
 
+# A downhole data table to build traces for: its layer, field mapping, filename suffix and the
+# attribute fields to copy to the trace layer. The intervals can optionally be composited to a fixed
+# length, or to the intervals of another layer (eg lithology), before the traces are built.
+class DownholeTable:
+    def __init__(self, layer, dataId, dataFrom, dataTo, suffix, fields,
+                 compositeMethod="None", compositeLength=2.0, compositeLayer=None, compositeId="", compositeFrom="", compositeTo=""):
+        self.layer = layer
+        self.layerId = layer.id() if layer is not None else ""
+        self.dataId = dataId
+        self.dataFrom = dataFrom
+        self.dataTo = dataTo
+        self.suffix = suffix
+        self.fields = fields
+        self.compositeMethod = compositeMethod
+        self.compositeLength = compositeLength
+        self.compositeLayer = compositeLayer
+        self.compositeLayerId = compositeLayer.id() if compositeLayer is not None else ""
+        self.compositeId = compositeId
+        self.compositeFrom = compositeFrom
+        self.compositeTo = compositeTo
+
+    # Look the layers up again in the project by their IDs. QGIS deletes a layer when it is removed from the
+    # project, so a layer kept from earlier may no longer be usable. A composite layer that has gone is set to None.
+    # Returns False if the data layer is no longer in the project.
+    def resolveLayers(self):
+        self.layer = QgsProject.instance().mapLayer(self.layerId)
+        self.compositeLayer = QgsProject.instance().mapLayer(self.compositeLayerId) if self.compositeLayerId else None
+        return self.layer is not None
+
+    # Are the intervals composited before the traces are built?
+    def isComposited(self):
+        if self.compositeMethod == "Fixed length":
+            return self.compositeLength > 0.0
+        if self.compositeMethod == "Layer intervals":
+            return self.compositeLayer is not None and self.compositeLayer.isValid()
+        return False
+
+
 class DrillTraceDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
     def __init__(self, manager, parent=None):
         """Constructor."""
@@ -34,8 +73,22 @@ class DrillTraceDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
         self.teSuffix.setText(self.drillManager.dataSuffix)
         self.checkSelectAll.setChecked(True)
         
+        # Compositing options
+        self.cbCompositeMethod.addItems(compositeMethods)
+        self.lbCompositeLayer.setFilters(QgsMapLayerProxyModel.NoGeometry)
+        self.lbCompositeLayer.setLayer(None)
+        self.cbCompositeMethod.currentIndexChanged.connect(self.onCompositeMethodChanged)
+        self.lbCompositeLayer.layerChanged.connect(self.onCompositeLayerChanged)
+        self.onCompositeMethodChanged()
+        
+        # Fill the list with the tables built last time
+        for table in self.drillManager.liveDataTables():
+            self.addTableItem(table)
+        
         self.lbDataLayer.layerChanged.connect(self.onDataLayerChanged)
         self.checkSelectAll.toggled.connect(self.onSelectAllChecked)
+        self.pbAddTable.clicked.connect(self.onAddTable)
+        self.pbRemoveTable.clicked.connect(self.onRemoveTable)
 
         self.onDataLayerChanged()
 
@@ -64,6 +117,26 @@ class DrillTraceDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
             self.fbDataTo.setCurrentIndex(-1)
             self.listFields.clear()
 
+    def onCompositeMethodChanged(self):
+        method = self.cbCompositeMethod.currentText()
+        self.sbCompositeLength.setEnabled(method == "Fixed length")
+        for widget in [self.lbCompositeLayer, self.fbCompositeId, self.fbCompositeFrom, self.fbCompositeTo]:
+            widget.setEnabled(method == "Layer intervals")
+
+    def onCompositeLayerChanged(self):
+        layer = self.lbCompositeLayer.currentLayer()
+        if layer is not None and layer.isValid():
+            self.fbCompositeId.setLayer(layer)
+            self.guessName(self.fbCompositeId, ["holeid", "id", "hole", "name"])
+            self.fbCompositeFrom.setLayer(layer)
+            self.guessName(self.fbCompositeFrom, ["from", "start", "depth"])
+            self.fbCompositeTo.setLayer(layer)
+            self.guessName(self.fbCompositeTo, ["to","end"])
+        else:
+            self.fbCompositeId.setCurrentIndex(-1)
+            self.fbCompositeFrom.setCurrentIndex(-1)
+            self.fbCompositeTo.setCurrentIndex(-1)
+
     def onSelectAllChecked(self):
 #        qgis.utils.iface.messageBar.pushMessage("SelectAll toggled")
         if self.checkSelectAll.isChecked() == True:
@@ -74,4 +147,51 @@ class DrillTraceDialog(QtWidgets.QDialog, dialogBase, FORM_CLASS):
 #            iface.messageBar().pushMessage("SelectNone")
             for index in range(self.listFields.count()):
                 self.listFields.item(index).setCheckState(QtCore.Qt.Unchecked)
-            
\ No newline at end of file
+            
+
+    # The downhole table currently set up in the dialog, or None if no valid layer is selected
+    def currentTable(self):
+        layer = self.lbDataLayer.currentLayer()
+        if layer is None or not layer.isValid():
+            return None
+        fields = []
+        for index in range(self.listFields.count()):
+            if self.listFields.item(index).checkState():
+                fields.append(self.listFields.item(index).text())
+        return DownholeTable(layer, self.fbDataId.currentField(), self.fbDataFrom.currentField(), self.fbDataTo.currentField(), self.teSuffix.text(), fields,
+                             self.cbCompositeMethod.currentText(), self.sbCompositeLength.value(), self.lbCompositeLayer.currentLayer(),
+                             self.fbCompositeId.currentField(), self.fbCompositeFrom.currentField(), self.fbCompositeTo.currentField())
+
+    # Add a table to the list, replacing any table that writes to the same suffix
+    def addTableItem(self, table):
+        for index in reversed(range(self.listTables.count())):
+            if self.listTables.item(index).data(QtCore.Qt.UserRole).suffix == table.suffix:
+                self.listTables.takeItem(index)
+        item = QtWidgets.QListWidgetItem()
+        text = "%s  \u2192  %s" % (table.layer.name(), table.suffix)
+        if table.compositeMethod == "Fixed length":
+            text += "  (%g m composites)" % (table.compositeLength)
+        elif table.isComposited():
+            text += "  (composited to %s)" % (table.compositeLayer.name())
+        item.setText(text)
+        item.setData(QtCore.Qt.UserRole, table)
+        self.listTables.addItem(item)
+
+    def onAddTable(self):
+        table = self.currentTable()
+        if table is not None:
+            self.addTableItem(table)
+
+    def onRemoveTable(self):
+        for item in self.listTables.selectedItems():
+            self.listTables.takeItem(self.listTables.row(item))
+
+    # The tables to build traces for. These are the tables in the list or,
+    # if the list is empty, just the table currently set up in the dialog.
+    def dataTables(self):
+        tables = [self.listTables.item(index).data(QtCore.Qt.UserRole) for index in range(self.listTables.count())]
+        if len(tables) == 0:
+            table = self.currentTable()
+            if table is not None:
+                tables.append(table)
+        return tables
@@ -107,6 +107,12 @@ class Geoscience:
         action.setEnabled(True)
         self.toolbar.addAction(action)
         self.actions.append(action)
+
+        action = self.menuDrill.addAction(QIcon(self.plugin_dir + "\icon\DrillPlan.png"), "Display Points")
+        action.triggered.connect(self.drillManager.onDrillDisplayPoints)
+        action.setEnabled(True)
+        self.toolbar.addAction(action)
+        self.actions.append(action)
         
         action = self.menuDrill.addAction(QIcon(self.plugin_dir + "\icon\DrillSection.png"), "Create Section")
         action.triggered.connect(self.drillManager.onDrillCreateSection)
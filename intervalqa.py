@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ intervalqa
+                              -------------------
+        begin                : 2018-04-13
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Roland Hill / MMG
+        email                : roland.hill@mmg.com
+ ***************************************************************************/
+ Bulk checks of downhole interval tables. Like the desurvey engine, everything
+ in here works on plain NumPy arrays so a whole table is checked in one pass.
+"""
+import numpy as np
+
+# The issues that can be found, indexed by the issue codes returned by checkIntervals
+qaIssues = ["Overlap", "Gap", "Inverted", "Beyond EOH", "Orphan"]
+qaOverlap, qaGap, qaInverted, qaBeyondEOH, qaOrphan = range(len(qaIssues))
+
+# Check a whole table of intervals at once.
+# holes holds the hole number (0 to H-1) of each interval and holeDepths the end of hole depth of each hole,
+# NaN for holes that have no collar. If holeDepths is None the orphan and end of hole checks are skipped.
+# Differences smaller than tolerance are ignored.
+# The intervals of each hole are sorted once, then compared with the deepest To above them, so an interval
+# inside a long interval further up is still seen as an overlap. Inverted intervals are left out of the
+# overlap and gap checks. Gaps above the first interval of a hole aren't reported.
+# Returns the interval index, issue code and the depth range of the issue for every issue found.
+def checkIntervals(holes, depthFrom, depthTo, holeDepths, tolerance=0.0):
+    holes = np.asarray(holes, dtype=np.int64)
+    depthFrom = np.asarray(depthFrom, dtype=float)
+    depthTo = np.asarray(depthTo, dtype=float)
+    rows = []
+    issues = []
+    issueFrom = []
+    issueTo = []
+
+    def report(index, issue, start, end):
+        rows.append(index)
+        issues.append(np.full(len(index), issue, dtype=np.int64))
+        issueFrom.append(start)
+        issueTo.append(end)
+
+    if holeDepths is not None:
+        # Intervals of holes that have no collar
+        holeDepths = np.asarray(holeDepths, dtype=float)
+        eoh = holeDepths[holes] if len(holes) > 0 else np.zeros(0)
+        orphan = np.isnan(eoh)
+        index = np.flatnonzero(orphan)
+        report(index, qaOrphan, depthFrom[index], depthTo[index])
+
+        # Intervals that go past the end of the hole
+        bottom = np.maximum(depthFrom, depthTo)
+        index = np.flatnonzero(~orphan & (bottom > eoh + tolerance))
+        report(index, qaBeyondEOH, np.maximum(np.minimum(depthFrom[index], depthTo[index]), eoh[index]), bottom[index])
+
+    # Intervals with From below To
+    inverted = depthFrom > depthTo + tolerance
+    index = np.flatnonzero(inverted)
+    report(index, qaInverted, depthTo[index], depthFrom[index])
+
+    # Sort the remaining intervals by hole, From and To
+    valid = np.flatnonzero(~inverted)
+    order = valid[np.lexsort((depthTo[valid], depthFrom[valid], holes[valid]))]
+    if len(order) > 1:
+        h = holes[order]
+        f = depthFrom[order]
+        t = depthTo[order]
+        # The deepest To above each interval in the same hole. The To depths are replaced by their rank, and
+        # offset by hole, so a single running maximum restarts at each hole and stays exact.
+        toValues, toRank = np.unique(t, return_inverse=True)
+        holeRank = np.unique(h, return_inverse=True)[1]
+        key = holeRank.astype(np.int64) * len(toValues) + toRank
+        deepest = toValues[np.maximum.accumulate(key) % len(toValues)]
+        sameHole = h[1:] == h[:-1]
+        above = deepest[:-1]
+        current = order[1:]
+
+        overlap = sameHole & (f[1:] < above - tolerance)
+        report(current[overlap], qaOverlap, f[1:][overlap], np.minimum(above, t[1:])[overlap])
+
+        gap = sameHole & (f[1:] > above + tolerance)
+        report(current[gap], qaGap, above[gap], f[1:][gap])
+
+    return np.concatenate(rows), np.concatenate(issues), np.concatenate(issueFrom), np.concatenate(issueTo)
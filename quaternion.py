@@ -28,7 +28,8 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 
-quaternion.py - This file defines the core Quaternion class
+quaternion.py - This file defines the core Quaternion class, and the QuaternionArray class
+    which applies the same operations to many quaternions at once
 
 """
 
@@ -38,6 +39,9 @@ from math import sqrt, pi, sin, cos, asin, acos, atan2, exp, log
 from copy import deepcopy
 import numpy as np # Numpy is required for many vector operations
 
+# Multiplying a quaternion 4-vector by this negates its vector part
+_conjugate_signs = np.array([1.0, -1.0, -1.0, -1.0])
+
 
 class Quaternion:
     """Class to represent a 4-dimensional complex number or quaternion.
@@ -50,6 +54,9 @@ class Quaternion:
 
     """
 
+    # Instances only ever hold their 4-vector, so they don't need a __dict__
+    __slots__ = ('q',)
+
     def __init__(self, *args, **kwargs):
         """Initialise a new Quaternion object. 
 
@@ -59,7 +66,7 @@ class Quaternion:
         
         """
         s = len(args)
-        if s is 0:
+        if s == 0:
             # No positional arguments supplied
             if len(kwargs) > 0:
                 # Keyword arguments provided
@@ -101,7 +108,7 @@ class Quaternion:
                 else:
                     keys = sorted(kwargs.keys())
                     elements = [kwargs[kw] for kw in keys]
-                    if len(elements) is 1:
+                    if len(elements) == 1:
                         r = float(elements[0])
                         self.q = np.array([r, 0.0, 0.0, 0.0])
                     else:
@@ -110,7 +117,7 @@ class Quaternion:
             else: 
                 # Default initialisation
                 self.q = np.array([1.0, 0.0, 0.0, 0.0])
-        elif s is 1:
+        elif s == 1:
             # Single positional argument supplied
             if isinstance(args[0], Quaternion):
                 self.q = args[0].q
@@ -131,6 +138,17 @@ class Quaternion:
             # More than one positional argument supplied
             self.q = self._validate_number_sequence(args, 4)
 
+    @classmethod
+    def _from_array(cls, array):
+        """Wrap an existing float64 Numpy 4-array in a new Quaternion object without validating or copying it.
+
+        For internal use, where the array is known to be valid and isn't shared with anything else,
+        eg. the freshly computed results of arithmetic operations.
+        """
+        result = cls.__new__(cls)
+        result.q = array
+        return result
+
     def _validate_number_sequence(self, seq, n):
         """Validate a sequence to be of a certain length and ensure it's a numpy array of floats.
 
@@ -139,14 +157,14 @@ class Quaternion:
         """
         if seq is None:
             return np.zeros(n)
-        if len(seq) is n:
+        if len(seq) == n:
             try:
                 l = [float(e) for e in seq]
             except ValueError:
                 raise ValueError("One or more elements in sequence <" + repr(seq) + "> cannot be interpreted as a real number")
             else:
                 return np.asarray(l)
-        elif len(seq) is 0:
+        elif len(seq) == 0:
             return np.zeros(n)
         else:
             raise ValueError("Unexpected number of elements in sequence. Got: " + str(len(seq)) + ", Expected: " + str(n) + ".")
@@ -353,12 +371,12 @@ class Quaternion:
 
     # Negation
     def __neg__(self):
-        return self.__class__(array= -self.q)
+        return self._from_array(-self.q)
 
     # Addition
     def __add__(self, other):
         if isinstance(other, Quaternion):
-            return self.__class__(array=self.q + other.q)
+            return self._from_array(self.q + other.q)
         return self + self.__class__(other)
 
     def __iadd__(self, other):
@@ -379,8 +397,17 @@ class Quaternion:
 
     # Multiplication
     def __mul__(self, other):
+        if isinstance(other, QuaternionArray):
+            return NotImplemented
         if isinstance(other, Quaternion):
-            return self.__class__(array=np.dot(self._q_matrix(), other.q))
+            # Hamilton product in plain floats, which is much quicker than Numpy for a single quaternion
+            a, b, c, d = self.q.tolist()
+            e, f, g, h = other.q.tolist()
+            return self._from_array(np.array([
+                a * e - b * f - c * g - d * h,
+                a * f + b * e + c * h - d * g,
+                a * g - b * h + c * e + d * f,
+                a * h + b * g - c * f + d * e]))
         return self * self.__class__(other)
     
     def __imul__(self, other):
@@ -422,8 +449,8 @@ class Quaternion:
                 n, theta = self.polar_decomposition
             except ZeroDivisionError:
                 # quaternion is a real number (no vector or imaginary part)
-                return Quaternion(scalar=self.scalar ** exponent)
-            return (self.norm ** exponent) * Quaternion(scalar=cos(exponent * theta), vector=(n * sin(exponent * theta)))
+                return self._from_array(np.array([self.scalar ** exponent, 0.0, 0.0, 0.0]))
+            return self._from_array(np.hstack((cos(exponent * theta), n * sin(exponent * theta))) * (self.norm ** exponent))
         return Quaternion(self)
 
     def __ipow__(self, other):
@@ -434,7 +461,7 @@ class Quaternion:
 
     # Quaternion Features
     def _vector_conjugate(self):
-        return np.hstack((self.q[0], -self.q[1:4]))
+        return self.q * _conjugate_signs
 
     def _sum_of_squares(self):
         return np.dot(self.q, self.q)
@@ -448,7 +475,7 @@ class Quaternion:
         Returns:
             A new Quaternion object clone with its vector part negated
         """
-        return self.__class__(scalar=self.scalar, vector= -self.vector)
+        return self._from_array(self._vector_conjugate())
 
     @property
     def inverse(self):
@@ -461,7 +488,7 @@ class Quaternion:
         """
         ss = self._sum_of_squares()
         if ss > 0:
-            return self.__class__(array=(self._vector_conjugate() / ss))
+            return self._from_array(self._vector_conjugate() / ss)
         else:
             raise ZeroDivisionError("a zero quaternion (0 + 0i + 0j + 0k) cannot be inverted")
 
@@ -596,27 +623,54 @@ class Quaternion:
                 Some types that are recognised are: numpy arrays, lists and tuples. 
                 A 3-vector can also be represented by a Quaternion object who's scalar part is 0 and vector part is the required 3-vector. 
                 Thus it is possible to call `Quaternion.rotate(q)` with another quaternion object as an input.
+                An (N,3) array-like of vectors is rotated in a single operation.
 
         Returns: 
             The rotated vector returned as the same type it was specified at input.
+            An (N,3) block of vectors is returned as an (N,3) Numpy array.
 
         Raises:
             TypeError: if any of the vector elements cannot be converted to a real number.
             ValueError: if `vector` cannot be interpreted as a 3-vector or a Quaternion object.
 
+        Note:
+            Vectors are rotated directly with v' = v + w t + u x t, where t = 2 u x v and u is the vector
+            part of the (unit) quaternion, without building intermediate Quaternion objects.
+
         """
         if isinstance(vector, Quaternion):
             return self._rotate_quaternion(vector)
-        q = Quaternion(vector=vector)
-        a = self._rotate_quaternion(q).vector
+        self._normalise()
+        v = np.asarray(vector, dtype=float)
+        if v.ndim == 2 and v.shape[1] == 3:
+            return self._rotate_block(v)
+        if v.size == 0:
+            v = np.zeros(3)
+        elif v.shape != (3,):
+            raise ValueError("Unexpected number of elements in sequence. Got: " + str(v.size) + ", Expected: 3.")
+
+        # Plain floats are much quicker than Numpy for a single 3-vector
+        w, x, y, z = self.q.tolist()
+        vx, vy, vz = v.tolist()
+        tx = 2.0 * (y * vz - z * vy)
+        ty = 2.0 * (z * vx - x * vz)
+        tz = 2.0 * (x * vy - y * vx)
+        a = [vx + w * tx + y * tz - z * ty,
+             vy + w * ty + z * tx - x * tz,
+             vz + w * tz + x * ty - y * tx]
         if isinstance(vector, list):
-            l = [x for x in a]
-            return l
+            return a
         elif isinstance(vector, tuple):
-            l = [x for x in a]
-            return tuple(l)
+            return tuple(a)
         else:
-            return a
+            return np.array(a)
+
+    def _rotate_block(self, v):
+        """Rotate an (N,3) Numpy array of vectors by the stored (unit) rotation."""
+        w = self.q[0]
+        u = self.q[1:4]
+        t = 2.0 * np.cross(u, v)
+        return v + w * t + np.cross(u, t)
 
     @classmethod
     def exp(cls, q):
@@ -1118,7 +1172,7 @@ class Quaternion:
         self.q[index] = float(value)
 
     def __copy__(self):
-        result = self.__class__(self.q)
+        result = self._from_array(self.q.copy())
         return result
 
     def __deepcopy__(self, memo):
@@ -1135,3 +1189,494 @@ class Quaternion:
     def to_radians(angle_deg):
         if angle_deg is not None:
             return float(angle_deg) / 180.0 * pi
+
+
+def _hamilton_product(p, q):
+    """Hamilton product of two arrays of quaternions in w, x, y, z order along the last axis.
+
+    The arrays are broadcast against each other, so a single quaternion can multiply an (N,4) array.
+    """
+    pw, px, py, pz = p[..., 0], p[..., 1], p[..., 2], p[..., 3]
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return np.stack((
+        pw * qw - px * qx - py * qy - pz * qz,
+        pw * qx + px * qw + py * qz - pz * qy,
+        pw * qy - px * qz + py * qw + pz * qx,
+        pw * qz + px * qy - py * qx + pz * qw), axis=-1)
+
+
+class QuaternionArray:
+    """Class to represent an array of N quaternions held in a single (N,4) Numpy array.
+
+    Provides the core operations of the Quaternion class applied element-wise to all
+    N quaternions at once, so large numbers of rotations can be handled at Numpy speed
+    instead of looping over individual Quaternion objects.
+
+    Attributes:
+        q: (N,4) Numpy array of quaternions, one per row, in w, x, y, z order
+
+    """
+
+    def __init__(self, array=None):
+        """Initialise a new QuaternionArray object.
+
+        Params:
+            array: [optional] an (N,4) array-like of quaternion elements, a single 4-element quaternion,
+                a sequence of Quaternion objects, a Quaternion or another QuaternionArray.
+                Defaults to an empty array.
+
+        Raises:
+            ValueError: if `array` cannot be interpreted as an (N,4) array of quaternions.
+        """
+        if array is None:
+            self.q = np.zeros((0, 4))
+            return
+        if isinstance(array, QuaternionArray):
+            self.q = array.q
+            return
+        if isinstance(array, Quaternion):
+            self.q = array.q.reshape(1, 4)
+            return
+        if len(array) > 0 and isinstance(array[0], Quaternion):
+            array = [q.q for q in array]
+        q = np.array(array, dtype=float)
+        if q.size == 0:
+            q = q.reshape(0, 4)
+        elif q.shape == (4,):
+            q = q.reshape(1, 4)
+        if q.ndim != 2 or q.shape[1] != 4:
+            raise ValueError("Unexpected shape of quaternion array. Got: " + str(q.shape) + ", Expected: (N, 4).")
+        self.q = q
+
+    @classmethod
+    def _from_axis_angle(cls, axis, angle):
+        """Initialise from axis and angle representation
+
+        Params:
+            axis: an (N,3) array-like of rotation axes, or a single 3-vector used for every angle
+            angle: an (N,) array-like of angles in radians, or a single angle used for every axis
+
+        Raises:
+            ZeroDivisionError: if any rotation axis has no length
+        """
+        axis = np.asarray(axis, dtype=float)
+        angle = np.asarray(angle, dtype=float)
+        axis, angle = np.broadcast_arrays(axis.reshape(-1, 3), angle.reshape(-1, 1))
+        mag = np.linalg.norm(axis, axis=1)
+        if np.any(mag == 0.0):
+            raise ZeroDivisionError("Provided rotation axis has no length")
+        theta = angle[:, 0] / 2.0
+        return cls(np.column_stack((np.cos(theta), axis * (np.sin(theta) / mag)[:, np.newaxis])))
+
+    @classmethod
+    def from_axis_angle(cls, axis, angle):
+        """Create a QuaternionArray from rotation axes and angles (in radians).
+
+        Either argument can be a single value that is used with every element of the other.
+        """
+        return cls._from_axis_angle(axis, angle)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Create a QuaternionArray from an (N,3,3) array of rotation matrices or an (N,4,4) array of transformation matrices.
+
+        Gives the same quaternions as `Quaternion(matrix=...)` would for each matrix.
+
+        Raises:
+            TypeError: if `matrix` is not a Numpy array.
+            ValueError: if the matrices are the wrong shape or are not special orthogonal.
+        """
+        try:
+            shape = matrix.shape
+        except AttributeError:
+            raise TypeError("Invalid matrix type: Input must be an (N,3,3) or (N,4,4) numpy array")
+
+        if len(shape) == 3 and shape[1:] == (3, 3):
+            R = matrix
+        elif len(shape) == 3 and shape[1:] == (4, 4):
+            R = matrix[:, :-1, :-1] # Upper left 3x3 sub-matrices
+        else:
+            raise ValueError("Invalid matrix shape: Input must be an (N,3,3) or (N,4,4) numpy array")
+
+        # Check matrix properties
+        if not np.allclose(np.matmul(R, np.swapaxes(R, 1, 2)), np.eye(3)):
+            raise ValueError("Matrices must be orthogonal, i.e. their transpose should be their inverse")
+        if not np.allclose(np.linalg.det(R), 1.0):
+            raise ValueError("Matrices must be special orthogonal i.e. their determinant must be +1.0")
+
+        # The trace method of Quaternion._from_matrix, choosing the same case for each matrix
+        m = np.swapaxes(R, 1, 2)
+        m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+        m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+        m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+        cases = [
+            (1 + m00 - m11 - m22, lambda t: [m12 - m21, t, m01 + m10, m20 + m02]),
+            (1 - m00 + m11 - m22, lambda t: [m20 - m02, m01 + m10, t, m12 + m21]),
+            (1 - m00 - m11 + m22, lambda t: [m01 - m10, m20 + m02, m12 + m21, t]),
+            (1 + m00 + m11 + m22, lambda t: [t, m12 - m21, m20 - m02, m01 - m10])]
+        choice = np.where(m22 < 0, np.where(m00 > m11, 0, 1), np.where(m00 < -m11, 2, 3))
+
+        q = np.empty((len(m), 4))
+        for c, (t, elements) in enumerate(cases):
+            rows = choice == c
+            q[rows] = np.column_stack(elements(t))[rows] * (0.5 / np.sqrt(t[rows]))[:, np.newaxis]
+        return cls(q)
+
+    def _operand(self, other):
+        """Convert the other operand of an arithmetic operation to an array of quaternions.
+
+        Real numbers (or an (N,) array of them) become real quaternions.
+        """
+        if isinstance(other, (QuaternionArray, Quaternion)):
+            return other.q
+        real = np.asarray(other, dtype=float)
+        q = np.zeros(real.shape + (4,))
+        q[..., 0] = real
+        return q
+
+    # Representation
+    def __repr__(self):
+        return "QuaternionArray({})".format(repr(self.q))
+
+    def __str__(self):
+        return "\n".join(str(Quaternion._from_array(q)) for q in self.q)
+
+    # Sequence behaviour
+    def __len__(self):
+        return len(self.q)
+
+    def __getitem__(self, index):
+        """A single index gives a Quaternion object, anything else (slices, masks, index arrays) a QuaternionArray"""
+        if isinstance(index, (int, np.integer)):
+            return Quaternion._from_array(self.q[index].copy())
+        return self.__class__(self.q[index])
+
+    def __iter__(self):
+        for q in self.q:
+            yield Quaternion._from_array(q.copy())
+
+    # Negation
+    def __neg__(self):
+        return self.__class__(-self.q)
+
+    # Addition
+    def __add__(self, other):
+        return self.__class__(self.q + self._operand(other))
+
+    def __radd__(self, other):
+        return self + other
+
+    # Subtraction
+    def __sub__(self, other):
+        return self.__class__(self.q - self._operand(other))
+
+    def __rsub__(self, other):
+        return -(self - other)
+
+    # Multiplication
+    def __mul__(self, other):
+        """Element-wise Hamilton product. A single Quaternion or real number multiplies every element."""
+        return self.__class__(_hamilton_product(self.q, self._operand(other)))
+
+    def __rmul__(self, other):
+        return self.__class__(_hamilton_product(self._operand(other), self.q))
+
+    # Exponentiation
+    def __pow__(self, exponent):
+        """Raise every quaternion to a real power, or each to its own power in an (N,) array of exponents.
+
+        Matches `Quaternion.__pow__` for each element, including pure real and zero quaternions.
+        """
+        exponent = np.asarray(exponent, dtype=float)
+        if exponent.ndim > 0:
+            exponent = exponent.reshape(-1)
+        exponent = np.broadcast_to(exponent, (len(self.q),))
+        norm = self.norm
+        v_norm = np.linalg.norm(self.q[:, 1:], axis=1)
+        result = self.q.copy()
+
+        # Quaternions with a vector part, using the polar decomposition
+        polar = v_norm > 0.0
+        e = exponent[polar]
+        theta = np.arccos(np.clip(self.q[polar, 0] / norm[polar], -1.0, 1.0))
+        scale = norm[polar] ** e
+        result[polar, 0] = scale * np.cos(e * theta)
+        result[polar, 1:] = (scale * np.sin(e * theta) / v_norm[polar])[:, np.newaxis] * self.q[polar, 1:]
+
+        # Pure real quaternions are just real numbers. Zero quaternions are left as they are.
+        real = ~polar & (norm > 0.0)
+        with np.errstate(invalid='ignore'):
+            result[real, 0] = self.q[real, 0] ** exponent[real]
+        return self.__class__(result)
+
+    # Quaternion Features
+    @property
+    def conjugate(self):
+        """Quaternion conjugates, encapsulated in a new instance.
+
+        For unit quaternions, this is the same as the inverse.
+        """
+        q = self.q.copy()
+        q[:, 1:] = -q[:, 1:]
+        return self.__class__(q)
+
+    @property
+    def inverse(self):
+        """Inverses of the quaternions, encapsulated in a new instance.
+
+        Raises:
+            ZeroDivisionError: if any of the quaternions is zero
+        """
+        ss = self._sum_of_squares()
+        if np.any(ss <= 0):
+            raise ZeroDivisionError("a zero quaternion (0 + 0i + 0j + 0k) cannot be inverted")
+        return self.__class__(self.conjugate.q / ss[:, np.newaxis])
+
+    def _sum_of_squares(self):
+        return np.einsum('ij,ij->i', self.q, self.q)
+
+    @property
+    def norm(self):
+        """(N,) Numpy array of the L2 norm of each quaternion 4-vector."""
+        return np.sqrt(self._sum_of_squares())
+
+    @property
+    def magnitude(self):
+        return self.norm
+
+    def _normalise(self):
+        """Normalise every quaternion in place. Zero quaternions are left as they are."""
+        self.q = self.normalised.q
+
+    @property
+    def normalised(self):
+        """Unit quaternion (versor) copies of the quaternions, encapsulated in a new instance.
+
+        Zero quaternions are left as they are.
+        """
+        norm = self.norm
+        return self.__class__(self.q / np.where(norm > 0.0, norm, 1.0)[:, np.newaxis])
+
+    @property
+    def unit(self):
+        return self.normalised
+
+    def is_unit(self, tolerance=1e-14):
+        """(N,) boolean Numpy array of whether each quaternion is of unit length to within `tolerance`."""
+        return np.abs(1.0 - self._sum_of_squares()) < tolerance
+
+    @classmethod
+    def slerp(cls, q0, q1, amount=0.5):
+        """Spherical Linear Interpolation between two arrays of quaternions.
+
+        The vectorised equivalent of `Quaternion.slerp`, using the closed form
+        `(sin((1-t)theta) q0 + sin(t theta) q1) / sin(theta)` for every element at once.
+        q and -q are the same rotation, so each `q1` is flipped into the same hemisphere
+        as its `q0` first, and the result always follows the shortest path between the rotations.
+
+        Params:
+            q0: first endpoint rotations as a QuaternionArray or (N,4) array-like. A single Quaternion is used for every element.
+            q1: second endpoint rotations, as for `q0`
+            amount: interpolation parameter between 0 and 1, either an (N,) array-like with one for each
+                element or a single value used for all of them. 0 is at `q0` and 1 is at `q1`.
+                Defaults to the midpoint (0.5).
+
+        Returns:
+            A new QuaternionArray object of the interpolated rotations. These are guaranteed to be unit quaternions.
+
+        Note:
+            The endpoints are normalised to unit quaternions if they are not already unit length.
+            Endpoints that are almost the same rotation are linearly interpolated and normalised,
+            avoiding the division by sin(theta) close to 0.
+        """
+        q0 = cls(q0).normalised.q
+        q1 = cls(q1).normalised.q
+        amount = np.clip(np.asarray(amount, dtype=float).reshape(-1), 0.0, 1.0)
+        # Single endpoints or amounts are used for every element
+        size = max(len(q0), len(q1), len(amount))
+        q0 = np.broadcast_to(q0, (size, 4))
+        q1 = np.broadcast_to(q1, (size, 4))
+        amount = np.broadcast_to(amount, (size,))
+        dot = np.einsum('ij,ij->i', q0, q1)
+
+        # Flip q1 into the same hemisphere as q0 by flipping the sign of its weight
+        sign = np.where(dot < 0.0, -1.0, 1.0)
+        theta = np.arccos(np.clip(np.abs(dot), 0.0, 1.0))
+        sin_theta = np.sin(theta)
+        linear = sin_theta < 1.0e-10
+        safe_sin = np.where(linear, 1.0, sin_theta)
+        w0 = np.where(linear, 1.0 - amount, np.sin((1.0 - amount) * theta) / safe_sin)
+        w1 = np.where(linear, amount, np.sin(amount * theta) / safe_sin) * sign
+        q = w0[:, np.newaxis] * q0 + w1[:, np.newaxis] * q1
+        if linear.any():
+            q[linear] /= np.linalg.norm(q[linear], axis=1)[:, np.newaxis]
+        return cls(q)
+
+    def rotate(self, vectors):
+        """Rotate 3D vectors by the rotations stored in the QuaternionArray object.
+
+        Params:
+            vectors: an (N,3) array-like with one vector for each quaternion, or a single 3-vector
+                that is rotated by every quaternion
+
+        Returns:
+            An (N,3) Numpy array of the rotated vectors.
+
+        Note:
+            The quaternions are treated as unit quaternions. They are normalised for the rotation
+            if they are not already unit length, but the object is not modified.
+        """
+        vectors = np.asarray(vectors, dtype=float)
+        q = self.normalised.q
+        w = q[:, 0:1]
+        u = q[:, 1:]
+        # v' = v + w t + u x t, where t = 2 u x v
+        t = 2.0 * np.cross(u, vectors)
+        return vectors + w * t + np.cross(u, t)
+
+    @property
+    def rotation_matrix(self):
+        """(N,3,3) Numpy array of the rotation matrix equivalent of each quaternion rotation.
+
+        Note:
+            The quaternions are treated as unit quaternions, as for `rotate`.
+        """
+        q = self.normalised.q
+        w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+        R = np.empty((len(q), 3, 3))
+        R[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+        R[:, 0, 1] = 2.0 * (x * y - w * z)
+        R[:, 0, 2] = 2.0 * (x * z + w * y)
+        R[:, 1, 0] = 2.0 * (x * y + w * z)
+        R[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+        R[:, 1, 2] = 2.0 * (y * z - w * x)
+        R[:, 2, 0] = 2.0 * (x * z - w * y)
+        R[:, 2, 1] = 2.0 * (y * z + w * x)
+        R[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+        return R
+
+    def get_axis(self, undefined=np.zeros(3)):
+        """(N,3) Numpy array of the unit axis of each quaternion rotation.
+
+        Params:
+            undefined: [optional] the axis given to null rotations (purely real quaternions),
+                which have no defined axis. Defaults to `[0, 0, 0]`.
+        """
+        tolerance = 1e-17
+        vector = self.normalised.q[:, 1:]
+        norm = np.linalg.norm(vector, axis=1)
+        axis = np.empty_like(vector)
+        defined = norm >= tolerance
+        axis[defined] = vector[defined] / norm[defined][:, np.newaxis]
+        axis[~defined] = undefined
+        return axis
+
+    @property
+    def axis(self):
+        return self.get_axis()
+
+    @property
+    def angle(self):
+        """(N,) Numpy array of the angle (in radians) of each quaternion rotation about its axis.
+
+        Each angle is in the range (-pi:pi], as for `Quaternion.angle`.
+        """
+        q = self.normalised.q
+        theta = 2.0 * np.arctan2(np.linalg.norm(q[:, 1:], axis=1), q[:, 0])
+        # Wrap to lie between -pi and pi, with odd multiples of pi wrapped to +pi
+        result = ((theta + pi) % (2 * pi)) - pi
+        result[result == -pi] = pi
+        return result
+
+    @property
+    def degrees(self):
+        return np.degrees(self.angle)
+
+    @property
+    def radians(self):
+        return self.angle
+
+    @property
+    def scalar(self):
+        """(N,) Numpy array of the real or scalar components"""
+        return self.q[:, 0]
+
+    @property
+    def vector(self):
+        """(N,3) Numpy array of the imaginary or vector components"""
+        return self.q[:, 1:]
+
+    @property
+    def elements(self):
+        """(N,4) Numpy array of all the elements"""
+        return self.q
+
+
+class SlerpInterpolator:
+    """Spherical Linear Interpolation between a fixed pair of quaternion rotations.
+
+    Everything that only depends on the endpoints (normalisation, the hemisphere flip, the angle
+    between them and its sine) is worked out once when the interpolator is created, so it can then
+    be evaluated at any number of fractions cheaply, eg. at every desurvey station between two surveys.
+
+    Gives the same results as `QuaternionArray.slerp`, including always taking the shortest path.
+
+    Attributes:
+        q0: the first endpoint as a unit quaternion 4-vector
+        q1: the second endpoint as a unit quaternion 4-vector, in the same hemisphere as `q0`
+        theta: the angle between `q0` and `q1` on the unit hypersphere, in radians
+        sin_theta: sin(theta)
+
+    """
+
+    def __init__(self, q0, q1):
+        """Initialise a new SlerpInterpolator object.
+
+        Params:
+            q0: first endpoint rotation as a Quaternion object or anything a Quaternion can be initialised from
+            q1: second endpoint rotation, as for `q0`
+
+        Note:
+            The endpoints are normalised to unit quaternions if they are not already unit length.
+        """
+        self.q0 = Quaternion(q0).normalised.q
+        q1 = Quaternion(q1).normalised.q
+        dot = float(np.dot(self.q0, q1))
+        # q and -q are the same rotation, so flip q1 into the same hemisphere as q0
+        if dot < 0.0:
+            q1 = -q1
+            dot = -dot
+        self.q1 = q1
+        self.theta = acos(min(dot, 1.0))
+        self.sin_theta = sin(self.theta)
+        # Nearly parallel endpoints are linearly interpolated to avoid dividing by sin(0)
+        self._linear = self.sin_theta < 1.0e-10
+
+    def __call__(self, amount=0.5):
+        """Interpolate between the endpoints.
+
+        Params:
+            amount: interpolation parameter between 0 and 1, 0 being at `q0` and 1 at `q1`.
+                Either a single real number or an (N,) array-like of them. Defaults to the midpoint (0.5).
+
+        Returns:
+            A new Quaternion object for a single amount, or a new QuaternionArray object with one
+            interpolated rotation for each amount. These are guaranteed to be unit quaternions.
+        """
+        amounts = np.asarray(amount, dtype=float)
+        if amounts.ndim == 0:
+            t = min(max(float(amounts), 0.0), 1.0)
+            if self._linear:
+                q = (1.0 - t) * self.q0 + t * self.q1
+                return Quaternion._from_array(q / sqrt(np.dot(q, q)))
+            w0 = sin((1.0 - t) * self.theta) / self.sin_theta
+            w1 = sin(t * self.theta) / self.sin_theta
+            return Quaternion._from_array(w0 * self.q0 + w1 * self.q1)
+
+        t = np.clip(amounts.reshape(-1), 0.0, 1.0)[:, np.newaxis]
+        if self._linear:
+            q = (1.0 - t) * self.q0 + t * self.q1
+            return QuaternionArray(q / np.linalg.norm(q, axis=1)[:, np.newaxis])
+        w0 = np.sin((1.0 - t) * self.theta) / self.sin_theta
+        w1 = np.sin(t * self.theta) / self.sin_theta
+        return QuaternionArray(w0 * self.q0 + w1 * self.q1)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ spatialindex
+                              -------------------
+        begin                : 2018-04-13
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by Roland Hill / MMG
+        email                : roland.hill@mmg.com
+ ***************************************************************************/
+ 3D R-tree over the segments of desurveyed drill traces. The tree is packed
+ with Sort-Tile-Recursive bulk loading and held in plain NumPy arrays, so it
+ can be saved next to a trace GeoPackage and loaded again without rebuilding.
+"""
+import numpy as np
+
+import heapq
+import os
+import shutil
+import tempfile
+import zipfile
+
+# File name of the segment index that belongs with a trace layer file name (without extension)
+def segmentIndexFilename(fileName):
+    return "%s.segidx.npz" % (fileName)
+
+# Segments between consecutive points of a set of polylines, held end to end in points with
+# polyline k being points[offsets[k]:offsets[k+1]].
+# Returns the (S,3) lower and upper corners of the segment boxes, the polyline of each segment
+# and the measured depths (column 3 of points) at each end of the segment.
+def polylineSegments(points, offsets):
+    points = np.asarray(points, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # Every point except the last of each polyline starts a segment
+    start = np.ones(offsets[-1], dtype=bool)
+    start[offsets[1:][np.diff(offsets) > 0] - 1] = False
+    start = np.flatnonzero(start)
+    lower = np.minimum(points[start, :3], points[start + 1, :3])
+    upper = np.maximum(points[start, :3], points[start + 1, :3])
+    polyline = np.searchsorted(offsets, start, side='right') - 1
+    return lower, upper, polyline, points[start, 3], points[start + 1, 3]
+
+# Every index from start[k] up to end[k] for each k, end to end
+def ranges(start, end):
+    size = end - start
+    return np.repeat(start - np.cumsum(size) + size, size) + np.arange(size.sum())
+
+# Group segments, in the order they were added, into runs of up to runSize consecutive segments of the same hole.
+# Segments follow their traces, so each run is a compact stretch of one hole.
+# Returns the (R+1,) offsets of the runs, and the lower and upper corners of each run's box.
+def segmentRuns(lower, upper, holeCodes, runSize):
+    count = len(holeCodes)
+    if count == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros((0, 3)), np.zeros((0, 3))
+    # A run starts at the first segment of each hole, and every runSize segments down it
+    holeStart = np.flatnonzero(np.concatenate(([True], holeCodes[1:] != holeCodes[:-1])))
+    position = np.arange(count) - np.repeat(holeStart, np.diff(np.append(holeStart, count)))
+    runStart = np.append(np.flatnonzero(position % runSize == 0), count)
+    return runStart, np.minimum.reduceat(lower, runStart[:-1]), np.maximum.reduceat(upper, runStart[:-1])
+
+# Sort-Tile-Recursive packing of boxes: slice them into slabs by x, each slab into strips by y, each strip by z,
+# so that each run of nodeSize boxes in the returned order is a compact node
+def packOrder(lower, upper, nodeSize):
+    count = len(lower)
+    centre = (lower + upper) / 2.0
+    leaves = -(-count // nodeSize)
+    tiles = max(int(np.ceil(leaves ** (1.0 / 3.0))), 1)
+    order = np.argsort(centre[:, 0], kind='stable')
+    slab = np.empty(count, dtype=np.int64)
+    slab[order] = np.arange(count) // (tiles * tiles * nodeSize)
+    order = np.lexsort((centre[:, 1], slab))
+    strip = np.empty(count, dtype=np.int64)
+    strip[order] = np.arange(count) // (tiles * nodeSize)
+    return np.lexsort((centre[:, 2], strip, slab))
+
+# Read the rows of an array saved in an open .npz archive a block at a time, without loading the whole array
+def readBlocks(archive, name, rows):
+    with archive.open(name + ".npy") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+        rowShape = shape[1:]
+        rowBytes = dtype.itemsize * int(np.prod(rowShape))
+        while True:
+            data = f.read(rows * rowBytes)
+            if not data:
+                return
+            yield np.frombuffer(data, dtype=dtype).reshape((-1,) + rowShape)
+
+class SegmentIndex:
+    # The arrays of a saved index that hold one row per segment, with the type and shape of each row
+    segmentColumns = (("lower", np.float64, (3,)), ("upper", np.float64, (3,)), ("holeCodes", np.int32, ()),
+                      ("depthFrom", np.float64, ()), ("depthTo", np.float64, ()), ("featureIds", np.int64, ()))
+
+    # Bulk load an R-tree over (N,3) arrays of box lower and upper corners. Each box has a hole ID,
+    # a measured depth range and the id of the feature it came from (-1 if there isn't one).
+    # The boxes of a hole should be in order along it, as runs of up to runSize consecutive boxes of a hole are
+    # the leaves of the tree. Long runs keep the tree small, so it can be packed in memory for any number of segments.
+    def __init__(self, lower, upper, holeIds, depthFrom, depthTo, featureIds=None, nodeSize=16, runSize=256):
+        self.nodeSize = int(nodeSize)
+        self.lower = np.asarray(lower, dtype=float).reshape(-1, 3)
+        self.upper = np.asarray(upper, dtype=float).reshape(-1, 3)
+        holeNames, holeCodes = np.unique(np.asarray(holeIds, dtype=str), return_inverse=True)
+        self.holeNames = holeNames
+        self.holeCodes = holeCodes.astype(np.int32).reshape(-1)
+        self.depthFrom = np.asarray(depthFrom, dtype=float)
+        self.depthTo = np.asarray(depthTo, dtype=float)
+        self.featureIds = np.full(len(self.lower), -1, dtype=np.int64) if featureIds is None else np.asarray(featureIds, dtype=np.int64)
+        self.runStart, runLower, runUpper = segmentRuns(self.lower, self.upper, self.holeCodes, int(runSize))
+        self.order = packOrder(runLower, runUpper, self.nodeSize)
+        self.buildLevels(runLower[self.order], runUpper[self.order])
+
+    # Build the levels of the tree from the boxes of the runs (in tree order) up. Node i of a level covers
+    # nodes i * nodeSize to (i + 1) * nodeSize - 1 of the level below, and run order[i] is leaf i.
+    def buildLevels(self, lower, upper):
+        self.levels = [(lower, upper)]
+        while len(self.levels[-1][0]) > self.nodeSize:
+            lo, up = self.levels[-1]
+            starts = np.arange(0, len(lo), self.nodeSize)
+            self.levels.append((np.minimum.reduceat(lo, starts), np.maximum.reduceat(up, starts)))
+
+    def __len__(self):
+        return len(self.lower)
+
+    # The hole ID of every segment
+    @property
+    def holeIds(self):
+        return self.holeNames[self.holeCodes]
+
+    # Children of the supplied nodes of a level, as indices into the level below
+    def children(self, level, nodes):
+        count = len(self.levels[level - 1][0])
+        first = nodes * self.nodeSize
+        return ranges(first, np.minimum(first + self.nodeSize, count))
+
+    # The segments of the supplied leaves
+    def segments(self, nodes):
+        runs = self.order[nodes]
+        return ranges(self.runStart[runs], self.runStart[runs + 1])
+
+    # Indices of all the segments whose boxes intersect the box from boxLower to boxUpper
+    def query(self, boxLower, boxUpper):
+        boxLower = np.asarray(boxLower, dtype=float)
+        boxUpper = np.asarray(boxUpper, dtype=float)
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        level = len(self.levels) - 1
+        nodes = np.arange(len(self.levels[level][0]))
+        while True:
+            lo, up = self.levels[level]
+            hit = np.all((lo[nodes] <= boxUpper) & (up[nodes] >= boxLower), axis=1)
+            nodes = nodes[hit]
+            if level == 0:
+                segments = self.segments(nodes)
+                hit = np.all((self.lower[segments] <= boxUpper) & (self.upper[segments] >= boxLower), axis=1)
+                return np.sort(segments[hit])
+            nodes = self.children(level, nodes)
+            level -= 1
+
+    # Indices of the count segments whose boxes are closest to the supplied point, nearest first
+    def nearest(self, point, count=1):
+        point = np.asarray(point, dtype=float)
+        result = []
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Best first search. The heap holds (distance, level, node) with the closest box on top.
+        # Level -1 holds the segments themselves.
+        def distances(lo, up):
+            gap = np.maximum(np.maximum(lo - point, point - up), 0.0)
+            return np.sqrt(np.sum(gap * gap, axis=1))
+
+        top = len(self.levels) - 1
+        nodes = np.arange(len(self.levels[top][0]))
+        heap = [(d, top, n) for d, n in zip(distances(*self.levels[top]).tolist(), nodes.tolist())]
+        heapq.heapify(heap)
+        while heap and len(result) < count:
+            d, level, node = heapq.heappop(heap)
+            if level == -1:
+                result.append(node)
+                continue
+            if level == 0:
+                nodes = self.segments(np.array([node]))
+                lo, up = self.lower[nodes], self.upper[nodes]
+            else:
+                nodes = self.children(level, np.array([node]))
+                lo, up = (corner[nodes] for corner in self.levels[level - 1])
+            for d, n in zip(distances(lo, up).tolist(), nodes.tolist()):
+                heapq.heappush(heap, (d, level - 1, n))
+        return np.array(result, dtype=np.int64)
+
+    # Lower and upper corners of every segment box
+    def boxes(self):
+        return self.lower, self.upper
+
+    # Save the index to a NumPy .npz file. The order of the runs is stored so loading doesn't need to sort.
+    def save(self, fileName):
+        np.savez(fileName, lower=self.lower, upper=self.upper, holeCodes=self.holeCodes, holeNames=self.holeNames,
+                 depthFrom=self.depthFrom, depthTo=self.depthTo, featureIds=self.featureIds,
+                 runStart=self.runStart, order=self.order, nodeSize=self.nodeSize)
+
+    # Load an index saved with save() or a SegmentIndexWriter
+    @staticmethod
+    def load(fileName):
+        with np.load(fileName) as data:
+            index = SegmentIndex.__new__(SegmentIndex)
+            index.nodeSize = int(data["nodeSize"])
+            for name, dtype, shape in SegmentIndex.segmentColumns:
+                setattr(index, name, data[name])
+            index.holeNames = data["holeNames"]
+            index.runStart = data["runStart"]
+            index.order = data["order"]
+        starts = index.runStart[:-1]
+        if len(starts) > 0:
+            index.buildLevels(np.minimum.reduceat(index.lower, starts)[index.order], np.maximum.reduceat(index.upper, starts)[index.order])
+        else:
+            index.buildLevels(np.zeros((0, 3)), np.zeros((0, 3)))
+        return index
+
+# Writes a segment index file from segments added a batch at a time, without holding them all in memory.
+# The segments are spooled to temporary files as they are added and only the boxes of their runs are kept,
+# to pack the tree when the index is closed. The file is the same as SegmentIndex.save() writes.
+class SegmentIndexWriter:
+    def __init__(self, fileName, nodeSize=16, runSize=256):
+        self.fileName = fileName
+        self.nodeSize = int(nodeSize)
+        self.runSize = int(runSize)
+        self.files = {name: tempfile.TemporaryFile() for name, dtype, shape in SegmentIndex.segmentColumns}
+        self.count = 0
+        # Code of each hole ID, in the order they were first seen
+        self.holes = {}
+        self.runStart = [np.zeros(1, dtype=np.int64)]
+        self.runLower = []
+        self.runUpper = []
+
+    # Add the polylines held end to end in the (P,4) points with measured depth in M, one hole ID and feature ID per polyline
+    def add(self, points, offsets, holeIds, featureIds):
+        lower, upper, polyline, depthFrom, depthTo = polylineSegments(points, offsets)
+        self.addSegments(lower, upper, np.asarray(holeIds, dtype=str)[polyline], depthFrom, depthTo,
+                         np.asarray(featureIds, dtype=np.int64)[polyline])
+
+    # Add segments given by their box corners, with a hole ID, depth range and feature ID for each
+    def addSegments(self, lower, upper, holeIds, depthFrom, depthTo, featureIds):
+        if len(lower) == 0:
+            return
+        names, inverse = np.unique(np.asarray(holeIds, dtype=str), return_inverse=True)
+        holeCodes = np.array([self.holes.setdefault(name, len(self.holes)) for name in names.tolist()], dtype=np.int32)[inverse.reshape(-1)]
+        for (name, dtype, shape), values in zip(SegmentIndex.segmentColumns, (lower, upper, holeCodes, depthFrom, depthTo, featureIds)):
+            self.files[name].write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        runStart, runLower, runUpper = segmentRuns(lower, upper, holeCodes, self.runSize)
+        self.runStart.append(runStart[1:] + self.count)
+        self.runLower.append(runLower)
+        self.runUpper.append(runUpper)
+        self.count += len(lower)
+
+    # Add the segments of the holes in keepHoles from an existing index file, a block of rows at a time
+    def addIndexFile(self, fileName, keepHoles, blockRows=65536):
+        with zipfile.ZipFile(fileName) as archive:
+            with archive.open("holeNames.npy") as f:
+                holeNames = np.lib.format.read_array(f)
+            keepCode = np.isin(holeNames, list(keepHoles))
+            blocks = [readBlocks(archive, name, blockRows) for name, dtype, shape in SegmentIndex.segmentColumns]
+            for lower, upper, holeCodes, depthFrom, depthTo, featureIds in zip(*blocks):
+                keep = keepCode[holeCodes]
+                self.addSegments(lower[keep], upper[keep], holeNames[holeCodes[keep]], depthFrom[keep], depthTo[keep], featureIds[keep])
+
+    # Pack the tree and write the index file. It is written under a temporary name and then renamed,
+    # so an index being read (eg by addIndexFile) is only replaced once the new one is complete.
+    def close(self):
+        runLower = np.concatenate(self.runLower) if self.runLower else np.zeros((0, 3))
+        runUpper = np.concatenate(self.runUpper) if self.runUpper else np.zeros((0, 3))
+        arrays = {"holeNames": np.array(list(self.holes), dtype=str), "runStart": np.concatenate(self.runStart),
+                  "order": packOrder(runLower, runUpper, self.nodeSize), "nodeSize": np.array(self.nodeSize)}
+        path = self.fileName + ".tmp"
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, dtype, shape in SegmentIndex.segmentColumns:
+                header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (self.count,) + shape}
+                spool = self.files[name]
+                spool.seek(0)
+                with archive.open(name + ".npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, header)
+                    shutil.copyfileobj(spool, f, 1 << 20)
+                spool.close()
+            for name, values in arrays.items():
+                with archive.open(name + ".npy", "w") as f:
+                    np.lib.format.write_array(f, values)
+        os.replace(path, self.fileName)